@@ -0,0 +1,162 @@
+import json
+import time
+import itertools
+import queue
+import platform
+import statistics
+
+import control.control as control
+from control.control import Control, RELAY_MASK
+from control.i2cbus import CountingI2C
+from control.mcp23008 import PORT_A7
+
+# Repetitions for driver primitives and for full control cycles
+REPEAT = 200
+REPEAT_CYCLE = 20
+
+# Unused MCP23008 pin, left as an input, for the latch write timing
+SPARE_PIN = PORT_A7
+
+
+def summarize(samples, transactions):
+    ms = sorted(t * 1000 for t in samples)
+    pct = statistics.quantiles(ms, n=100, method='inclusive') if len(ms) > 1 else ms * 99
+    return {
+        'n': len(ms),
+        'mean_ms': statistics.fmean(ms),
+        'min_ms': ms[0],
+        'p50_ms': pct[49],
+        'p90_ms': pct[89],
+        'p99_ms': pct[98],
+        'max_ms': ms[-1],
+        'i2c_transactions': statistics.fmean(transactions),
+    }
+
+
+class Benchmark:
+    """Latency and I2C transaction counts for driver primitives and control cycles
+
+    On the Pi latencies are wall clock times, stop the seedling service first.
+    On the simulated bus latencies are modelled bus times on the virtual clock and
+    host_ms is the CPU time the simulation took.
+    """
+
+    def __init__(self, i2c, clock=time):
+        self.clock = clock
+        self.i2c = CountingI2C(i2c)
+        self.ctl = Control(queue.Queue(), queue.Queue(), i2c=self.i2c, startup_file=None)
+        self.results = {}
+
+    def run(self, name, fn, repeat=REPEAT):
+        samples = []
+        host = []
+        transactions = []
+        polls = self.ctl.onewire.polls
+        polls_start = sum(polls.values())
+        for _ in range(repeat):
+            self.i2c.reset_counts()
+            t0 = time.perf_counter()
+            t = self.clock.monotonic()
+            fn()
+            samples.append(self.clock.monotonic() - t)
+            host.append(time.perf_counter() - t0)
+            transactions.append(self.i2c.transactions)
+        result = summarize(samples, transactions)
+        result['host_ms'] = statistics.fmean(host) * 1000
+        result['onewire_polls'] = (sum(polls.values()) - polls_start) / repeat
+        self.results[name] = result
+        return result
+
+    def cycle(self):
+        # One complete control update, conversion wait included
+        t_ready = self.ctl.start_conversion()
+        self.clock.sleep(t_ready - self.clock.monotonic())
+        self.ctl.collect_results()
+
+    def run_all(self, repeat=REPEAT, repeat_cycle=REPEAT_CYCLE):
+        ctl = self.ctl
+        ow = ctl.onewire
+        sensor = ctl.ctl_chans[0].sensor
+        gpio = ctl.gpio
+
+        self.run('ds2482.reset', ow.reset, repeat)
+        self.run('ds2482.write_byte', lambda: ow.write_byte(0xFF), repeat)
+        self.run('ds2482.read_byte', ow.read_byte, repeat)
+        self.run('ds18b20.select', sensor.select, repeat)
+        self.run('ds18b20.scratchpad', lambda: sensor.scratchpad, repeat)
+        sensor.convert_t()
+        self.run('ds18b20.temperature_short', lambda: sensor.temperature_short, repeat)
+        # olat() reads and unchanged writes are served from the shadow registers, so
+        # toggle the latch of a spare input pin: a real write that leaves the relays alone
+        latch = itertools.cycle((SPARE_PIN, 0))
+        self.run('mcp23008.olat_write', lambda: gpio.olat(SPARE_PIN, next(latch)), repeat)
+        self.run('mcp23008.resync', gpio.resync, repeat)
+        self.run('control.cycle', self.cycle, repeat_cycle)
+
+        # Leave the relays off
+        gpio.olat(RELAY_MASK | SPARE_PIN, RELAY_MASK)
+        return self.results
+
+    def report(self, mode):
+        return {
+            'mode': mode,
+            'host': platform.node(),
+            'python': platform.python_version(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'results': self.results,
+        }
+
+
+def compare(report, baseline):
+    print('%-22s %10s %10s %8s %8s %8s' % ('', 'p50 ms', 'base ms', 'ratio', 'i2c', 'base'))
+    for name, result in report['results'].items():
+        base = baseline['results'].get(name)
+        if base is None:
+            continue
+        print('%-22s %10.3f %10.3f %8.2f %8.1f %8.1f' % (
+            name, result['p50_ms'], base['p50_ms'], result['p50_ms'] / base['p50_ms'] if base['p50_ms'] else 0,
+            result['i2c_transactions'], base['i2c_transactions']))
+
+
+if __name__ == '__main__':
+
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Seedling bus and control cycle benchmarks')
+    parser.add_argument('--sim', action='store_true', help='run against the simulated bus')
+    parser.add_argument('--frequency', type=int, default=100000, help='simulated I2C clock (Hz)')
+    parser.add_argument('--repeat', type=int, default=REPEAT)
+    parser.add_argument('--out', help='save results as JSON')
+    parser.add_argument('--compare', help='compare with saved JSON results')
+    args = parser.parse_args()
+
+    if args.sim:
+        from control.plant import VirtualClock
+        from control.simulator import seedling_bus
+
+        clock = VirtualClock()
+        i2c, devices = seedling_bus(clock, frequency=args.frequency)
+        with clock:
+            bench = Benchmark(i2c, clock)
+            bench.run_all(args.repeat)
+            bench.ctl.close()
+        report = bench.report('sim')
+    else:
+        bench = Benchmark(control.i2c_bus())
+        bench.run_all(args.repeat)
+        bench.ctl.close()
+        report = bench.report('pi')
+
+    print('%-22s %8s %8s %8s %8s %8s %8s %8s' % ('', 'mean ms', 'p50', 'p90', 'p99', 'max', 'i2c', 'polls'))
+    for name, result in report['results'].items():
+        print('%-22s %8.3f %8.3f %8.3f %8.3f %8.3f %8.1f %8.1f' % (
+            name, result['mean_ms'], result['p50_ms'], result['p90_ms'],
+            result['p99_ms'], result['max_ms'], result['i2c_transactions'], result['onewire_polls']))
+
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(report, json.load(f))
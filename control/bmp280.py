@@ -1,5 +1,8 @@
 import logging
 import time
+import struct
+
+import adafruit_bus_device.i2c_device as i2c_device
 
 # Save a logging file
 LOGFILE = None
@@ -97,42 +100,51 @@ BMP280_DIG_P7       = 0x9A  # Signed
 BMP280_DIG_P8       = 0x9C  # Signed
 BMP280_DIG_P9       = 0x9E  # Signed
 
+# Calibration parameters dig_T1 through dig_P9 in one burst read
+BMP280_CALIBRATION  = struct.Struct('<HhhHhhhhhhhh')
+
 # Status register
 BMP280_STATUS_BUSY  = 0x08  # busy with conversions, 1 => busy
 BMP280_STATUS_UPDATE = 0x01  # busy updating NVM data, 1 => busy
 
+# Start up time after a power on reset (secs)
+BMP280_STARTUP_TIME = 0.002
+
 class BMP280(object):
 
-    def __init__(self, address=BMP280_I2C_ADDR, i2c=None, **kwargs):
+    def __init__(self, i2c, address=BMP280_I2C_ADDR):
 
-        # Initialize logging
+        # Initialize logging, the handlers are added by the first instance only
         self._logger = logging.getLogger('BMP280')
-        self._logger.setLevel(LOGLEVEL)
-        formatter = logging.Formatter(
-            '%(levelname)s %(asctime)s %(message)s',
-            '%Y-%m-%d %H:%M:%S'
-        )
-
-        ch = logging.StreamHandler()
-        ch.setLevel(logging.DEBUG)
-        ch.setFormatter(formatter)
-        self._logger.addHandler(ch)
-
-        if LOGFILE:
-            fh = logging.FileHandler(LOGFILE)
-            fh.setLevel(LOGLEVEL)
-            fh.setFormatter(formatter)
-            self._logger.addHandler(fh)
+        if not self._logger.handlers:
+            self._logger.setLevel(LOGLEVEL)
+            formatter = logging.Formatter(
+                '%(levelname)s %(asctime)s %(message)s',
+                '%Y-%m-%d %H:%M:%S'
+            )
+
+            ch = logging.StreamHandler()
+            ch.setLevel(logging.DEBUG)
+            ch.setFormatter(formatter)
+            self._logger.addHandler(ch)
+
+            if LOGFILE:
+                fh = logging.FileHandler(LOGFILE)
+                fh.setLevel(LOGLEVEL)
+                fh.setFormatter(formatter)
+                self._logger.addHandler(fh)
 
         # Create I2C device.
-        if i2c is None:
-            import Adafruit_GPIO.I2C as I2C
-            i2c = I2C
-        self._device = i2c.get_i2c_device(address, **kwargs)
+        self._device = i2c_device.I2CDevice(i2c, address)
 
-        # Check device ID and issue reset
-        assert self.chip_id() == 0x58
+        # Check device ID and issue reset, wait for the calibration to be copied from NVM
+        chip_id = self.chip_id()
+        if chip_id != 0x58:
+            raise ValueError('Unexpected chip id 0x%02X' % chip_id)
         self.reset()
+        time.sleep(BMP280_STARTUP_TIME)
+        while self.status() & BMP280_STATUS_UPDATE:
+            time.sleep(BMP280_STARTUP_TIME)
 
         # Load calibration values.
         self.load_calibration()
@@ -154,39 +166,50 @@ class BMP280(object):
             self.dig_p9 = 6000
 
         else:
-            self.dig_t1 = self._device.readU16(BMP280_DIG_T1)   # UINT16
-            self.dig_t2 = self._device.readS16(BMP280_DIG_T2)   # INT16
-            self.dig_t3 = self._device.readS16(BMP280_DIG_T3)   # INT16
-            self.dig_p1 = self._device.readU16(BMP280_DIG_P1)   # UINT16
-            self.dig_p2 = self._device.readS16(BMP280_DIG_P2)   # INT16
-            self.dig_p3 = self._device.readS16(BMP280_DIG_P3)   # INT16
-            self.dig_p4 = self._device.readS16(BMP280_DIG_P4)   # INT16
-            self.dig_p5 = self._device.readS16(BMP280_DIG_P5)   # INT16
-            self.dig_p6 = self._device.readS16(BMP280_DIG_P6)   # INT16
-            self.dig_p7 = self._device.readS16(BMP280_DIG_P7)   # INT16
-            self.dig_p8 = self._device.readS16(BMP280_DIG_P8)   # INT16
-            self.dig_p9 = self._device.readS16(BMP280_DIG_P9)   # INT16
+            # UINT16 dig_T1 and dig_P1, the others INT16
+            (self.dig_t1, self.dig_t2, self.dig_t3,
+             self.dig_p1, self.dig_p2, self.dig_p3, self.dig_p4, self.dig_p5,
+             self.dig_p6, self.dig_p7, self.dig_p8, self.dig_p9) = BMP280_CALIBRATION.unpack(
+                self._read(BMP280_DIG_T1, BMP280_CALIBRATION.size))
+
+        # Shifted constants of the integer compensation
+        self._t1_x2 = self.dig_t1 << 1
+        self._p2_x = self.dig_p2 << 12
+        self._p4_x = self.dig_p4 << 35
+        self._p5_x = self.dig_p5 << 17
+        self._p7_x = self.dig_p7 << 4
+
+    def _read(self, register, length):
+        # Register burst read, one I2C transaction
+        buf = bytearray(length)
+        with self._device as device:
+            device.write_then_readinto(bytes([register]), buf)
+        return buf
+
+    def _write(self, register, data):
+        with self._device as device:
+            device.write(bytes([register, data & 0xFF]))
 
     def reset(self):
-        self._device.write8(BMP280_RESET, 0xB6)
+        self._write(BMP280_RESET, 0xB6)
 
     def chip_id(self):
-        data = self._device.readU8(BMP280_CHIP_ID)
+        data = self._read(BMP280_CHIP_ID, 1)[0]
         self._logger.debug('chip id: 0x%02X', data)
         return data
 
     def status(self):
-        return self._device.readU8(BMP280_STATUS)
+        return self._read(BMP280_STATUS, 1)[0]
 
     def control(self, data=None):
         if data is not None:
-            self._device.write8(BMP280_CONTROL, data)
-        return self._device.readU8(BMP280_CONTROL)
+            self._write(BMP280_CONTROL, data)
+        return self._read(BMP280_CONTROL, 1)[0]
 
     def config(self, data=None):
         if data is not None:
-            self._device.write8(BMP280_CONFIG, data)
-        data = self._device.readU8(BMP280_CONFIG)
+            self._write(BMP280_CONFIG, data)
+        data = self._read(BMP280_CONFIG, 1)[0]
         self._logger.debug('config: 0x%02X', data)
         return data
 
@@ -196,6 +219,19 @@ class BMP280(object):
         self._logger.debug('oversample: 0x%02X', data)
         return data
 
+    def normal_mode(self, os_mode, standby=BMP280_STANDBY_1000, filter=BMP280_FILTER_COEFF_4):
+        """Measure continuously, one conversion per standby period through the IIR filter
+
+        The data registers always hold the latest filtered result, read_sensor
+        needs no conversion or status polling.
+        """
+        # The config register is only written reliably in sleep mode
+        self.os_mode(os_mode)
+        self.config(standby | filter)
+        data = self.control(self._os_mode['CONTROL'] | BMP280_MODE_NORMAL)
+        self._logger.debug('normal: 0x%02X', data)
+        return data
+
     def convert(self, mode, sleep=True):
         data = self.control(self._os_mode['CONTROL'] | mode & BMP280_MODE_MASK)
         while sleep and (self.status() & BMP280_STATUS_BUSY):
@@ -207,19 +243,19 @@ class BMP280(object):
 
         if temp and pres:
             # Read uncompensated pressure and temperature
-            data = self._device.readList(BMP280_DATA, 6)
+            data = self._read(BMP280_DATA, 6)
             adc_p = data[0] << 12 | data[1] << 4 | data[2] >> 4
             adc_t = data[3] << 12 | data[4] << 4 | data[5] >> 4
             # self._logger.debug('raw pres: %d raw temp: %d', adc_p, adc_t)
         elif pres:
             # Read uncompensated pressure
-            data = self._device.readList(BMP280_PRES_DATA, 3)
+            data = self._read(BMP280_PRES_DATA, 3)
             adc_p = data[0] << 12 | data[1] << 4 | data[2] >> 4
             adc_t = None
             # self._logger.debug('raw pres: %d raw temp: None', adc_p)
         elif temp:
             # Read uncompensated temperature
-            data = self._device.readList(BMP280_TEMP_DATA, 3)
+            data = self._read(BMP280_TEMP_DATA, 3)
             adc_p = None
             adc_t = data[0] << 12 | data[1] << 4 | data[2] >> 4
             # self._logger.debug('raw pres: None raw temp: %d', adc_t)
@@ -235,57 +271,70 @@ class BMP280(object):
             return adc_p, adc_t
 
     def compensate(self, adc_p, adc_t):
-        # Compensate temperature
-        self._logger.debug('temp comp')
-        var1 = (adc_t / 16384 - self.dig_t1 / 1024) * self.dig_t2
-        self._logger.debug('var1: %f', var1)
-        var2 = (adc_t / 131072 - self.dig_t1 / 8192.0) * (adc_t / 131072 - self.dig_t1 / 8192) * self.dig_t3
-        self._logger.debug('var2: %f', var2)
+        """Pressure (Pa) and temperature (deg C), the datasheet's integer fixed point algorithm"""
+        # Temperature in 0.01 deg C
+        var1 = (((adc_t >> 3) - self._t1_x2) * self.dig_t2) >> 11
+        var2 = (adc_t >> 4) - self.dig_t1
+        var2 = (((var2 * var2) >> 12) * self.dig_t3) >> 14
         t_fine = var1 + var2
-        self._logger.debug('t_fine: %f', t_fine)
-
-        # Compensate pressure
-        self._logger.debug('pres comp')
-        var1 = t_fine / 2 - 64000
-        self._logger.debug('var1: %f', var1)
-        var2 = var1 ** 2 * self.dig_p6 / 32768
-        self._logger.debug('var2: %f', var2)
-        var2 += var1 * self.dig_p5 * 2
-        self._logger.debug('var2: %f', var2)
-        var2 = var2 / 4 + self.dig_p4 * 65536
-        self._logger.debug('var2: %f', var2)
-        var1 = (self.dig_p3 * var1 ** 2 / 524288 + self.dig_p2 * var1) / 524288
-        self._logger.debug('var1: %f', var1)
-        var1 = (1 + var1 / 32768) * self.dig_p1
-        self._logger.debug('var1: %f', var1)
+        T = (t_fine * 5 + 128) >> 8
+
+        # Pressure in Q24.8 Pa
+        var1 = t_fine - 128000
+        var2 = var1 * var1 * self.dig_p6 + var1 * self._p5_x + self._p4_x
+        var1 = (((var1 * var1 * self.dig_p3) >> 8) + var1 * self._p2_x + (1 << 47)) * self.dig_p1 >> 33
         if var1 == 0: return None  # avoid division by zero
-        p = 1048576 - adc_p
-        self._logger.debug('p: %f', p)
-        p = (p - var2 / 4096) * 6250 / var1
-        self._logger.debug('p: %f', p)
-        var1 = self.dig_p9 * p ** 2 / 2147483648
-        self._logger.debug('var1: %f', var1)
-        var2 = p * self.dig_p8 / 32768
-        self._logger.debug('var2: %f', var2)
-        P = p + (var1 + var2 + self.dig_p7) / 16    # pressure in Pa
-        T = (t_fine * 5 + 128) / 25600  # temperature in degrees C
-
-        return P, T
+        p = (((1048576 - adc_p) << 31) - var2) * 3125 // var1
+        var1 = (self.dig_p9 * (p >> 13) * (p >> 13)) >> 25
+        var2 = (self.dig_p8 * p) >> 19
+        P = ((p + var1 + var2) >> 8) + self._p7_x
+
+        return P / 256, T / 100
+
+    def compensate_array(self, adc):
+        """Compensate an array of raw (adc_p, adc_t) samples, returns pressure and temperature arrays
+
+        Same integer algorithm as compensate vectorized with NumPy, for replaying buffered
+        samples. Pressure is NaN where compensate would return None.
+        """
+        import numpy as np
+
+        adc = np.asarray(adc, dtype=np.int64).reshape(-1, 2)
+        adc_p, adc_t = adc[:, 0], adc[:, 1]
+
+        var1 = (((adc_t >> 3) - self._t1_x2) * self.dig_t2) >> 11
+        var2 = (adc_t >> 4) - self.dig_t1
+        var2 = (((var2 * var2) >> 12) * self.dig_t3) >> 14
+        t_fine = var1 + var2
+        T = (t_fine * 5 + 128) >> 8
+
+        var1 = t_fine - 128000
+        var2 = var1 * var1 * self.dig_p6 + var1 * self._p5_x + self._p4_x
+        var1 = (((var1 * var1 * self.dig_p3) >> 8) + var1 * self._p2_x + (1 << 47)) * self.dig_p1 >> 33
+        valid = var1 != 0
+        p = (((1048576 - adc_p) << 31) - var2) * 3125 // np.where(valid, var1, 1)
+        var1 = (self.dig_p9 * (p >> 13) * (p >> 13)) >> 25
+        var2 = (self.dig_p8 * p) >> 19
+        P = ((p + var1 + var2) >> 8) + self._p7_x
+
+        return np.where(valid, P / 256, np.nan), T / 100
 
 if __name__ == '__main__':
 
-    bmp = BMP280()
+    import board
+    import busio
+
+    i2c = busio.I2C(board.SCL, board.SDA)
+    bmp = BMP280(i2c)
 
     bmp.load_calibration(sample=True)
     print('sample calibration data -')
     print('pres: %.2f Pa temp: %.2f' % bmp.compensate(415148, 519888))
 
     bmp.load_calibration()
-    bmp.os_mode(BMP280_OS_MODE_HIGH_RESOLUTION)
-    bmp.config(BMP280_FILTER_COEFF_4)
-    print('High resolution conversion.')
+    bmp.normal_mode(BMP280_OS_MODE_HIGH_RESOLUTION, BMP280_STANDBY_1000, BMP280_FILTER_COEFF_4)
+    print('High resolution, normal mode.')
     while True:
-        bmp.convert(BMP280_MODE_FORCED)
         pres, temp = bmp.read_sensor()
         print('pres: %.2f hPa temp: %.2f ' % (pres / 100, temp * 9 / 5 + 32))
         time.sleep(1.0)
@@ -1,52 +1,161 @@
 import os
 import queue
+import asyncio
 import time
 import re
 import itertools
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
-import board
-import busio
-from control.ds2482 import DS2482
-from control.ds18b20 import DS18B20, OneWireDataError, CONVERT_RES_10_BIT
+from control.ds2482 import DS2482, DS2482_ADDRESS
+from control.ds18b20 import DS18B20, OneWireDataError, OneWireCRCError
+from control.ds18b20 import CONVERT_RES_9_BIT, CONVERT_RES_11_BIT
+from control.ds18b20 import DS18B20_SENSORS
 from control.ds18b20 import to_fahrenheit
 from control.mcp23008 import MCP23008
+from control.bmp280 import BMP280, BMP280_I2C_ADDR, BMP280_OS_MODE_STANDARD_RESOLUTION
+from control.bmp280 import BMP280_STANDBY_1000, BMP280_FILTER_COEFF_4
 from control.mcp23008 import PORT_A0, PORT_A1, PORT_A2, PORT_A3
+from control.i2cbus import CountingI2C, I2CArbiter
+from control.i2cbus import PRIORITY_RELAY, PRIORITY_CONTROL, PRIORITY_AUX
+from control.metrics import Metrics
+from control.status import StatusBlock
+from control.ring import SampleRing
 
 CYCLE_TIME = 5
+
+# Days of samples kept in the recent sample ring
+RING_DAYS = 7
 HYSTERESIS = 1.0
-CONVERT_RES = CONVERT_RES_10_BIT
 
-# Channel name, temperature sensor ID and optional relay port
+# Sensor resolution near the setpoint and elsewhere. The band includes the switching
+# points at the setpoint +/- HYSTERESIS with a margin for the coarser reading.
+CONVERT_RES_NEAR = CONVERT_RES_11_BIT
+CONVERT_RES_FAR = CONVERT_RES_9_BIT
+CONVERT_RES_BAND = 2 * HYSTERESIS
+
+# Convert all sensors with one Skip ROM broadcast rather than one sensor at a time
+CONVERT_BROADCAST = True
+
+# Read only the temperature bytes of the scratchpad, without the CRC. A reading outside
+# the range (deg F) or changing faster than the rate (deg F/sec) since the last one is
+# read again in full.
+SHORT_READ = False
+SHORT_READ_RANGE = (35.0, 110.0)
+SHORT_READ_RATE = 0.5
+
+# 1-Wire buses: DS2482 I2C address and DS2482-800 channel (None for a DS2482-100).
+# Conversions on separate DS2482s overlap and each DS2482 is read by its own thread,
+# the channels of a DS2482-800 share one strong pullup so parasitic power conversions
+# on them are serialized.
+ONEWIRE_BUSES = {
+    'W0': (DS2482_ADDRESS, None),
+}
+
+# Channel name, temperature sensor ID, optional relay port and 1-Wire bus
 CHAN_PARAMS = (
-    ('A', 'C1', PORT_A0),
-    ('B', 'C2', PORT_A1),
-    ('C', 'C3', PORT_A2),
-    ('D', 'C4', PORT_A3),
-    ('C5', 'C5', None),
+    ('A', 'C1', PORT_A0, 'W0'),
+    ('B', 'C2', PORT_A1, 'W0'),
+    ('C', 'C3', PORT_A2, 'W0'),
+    ('D', 'C4', PORT_A3, 'W0'),
+    ('C5', 'C5', None, 'W0'),
 )
 
 RELAY_MASK = PORT_A0 | PORT_A1 | PORT_A2 | PORT_A3
 
+# Ambient temperature and pressure channel from a BMP280, left out if no BMP280 answers
+# at the address (None to not look for one). The BMP280 converts continuously in normal
+# mode, one sample per second through an IIR filter settling over about one cycle.
+AMBIENT_CHAN = 'AMB'
+AMBIENT_ID = 'BMP280'
+BMP280_ADDRESS = BMP280_I2C_ADDR
+BMP280_OS_MODE = BMP280_OS_MODE_STANDARD_RESOLUTION
+BMP280_STANDBY = BMP280_STANDBY_1000
+BMP280_FILTER = BMP280_FILTER_COEFF_4
+
+# Cycles between checks of the GPIO registers against the driver's shadow copies
+GPIO_RESYNC_CYCLES = 60
+
+# Run the asyncio control engine rather than the blocking control loop
+ASYNC_ENGINE = False
+
+# Longest wait for a message (secs) in the asyncio engine, the queue is read in a
+# worker thread which only notices the engine exiting between waits
+MSG_POLL = 0.5
+
 STARTUP_FILE = os.path.join(os.path.dirname(__file__), 'startup.config')
 
+# Sensor IDs and ROM codes found on the 1-wire bus
+SENSOR_CACHE = os.path.join(os.path.dirname(__file__), 'sensors.cache')
+
+# The Pi's I2C bus, the hardware libraries are only imported when running on the Pi
+def i2c_bus():
+    import board
+    import busio
+    return busio.I2C(board.SCL, board.SDA)
+
+# Replace a file in one step, a power cut leaves either the old or the new contents
+def write_atomic(filename, text):
+    tmp = filename + '.tmp'
+    with open(tmp, 'w') as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, filename)
+
+# SET messages can be coalesced with other queued SETs
+def is_set(msg):
+    return msg.strip().upper().split()[:1] == ['SET']
+
 # Standalone procedure to shutdown the IO
-def shutdown():
-    i2c = busio.I2C(board.SCL, board.SDA)
+def shutdown(i2c=None):
+    if i2c is None:
+        i2c = i2c_bus()
     MCP23008(i2c).output_high(RELAY_MASK).config_input(RELAY_MASK)
 
 class ControlChannel:
 
     # Channels with no control port represent auxiliary temperature channels
-    def __init__(self, name, temp_id, onewire, port=None):
+    def __init__(self, name, temp_id, onewire, port=None, rom=None):
         self.name = name
         self.temp_id = temp_id
-        self.sensor =  DS18B20(onewire, temp_id, res=CONVERT_RES)
+        self.onewire = onewire
+        self.sensor =  DS18B20(onewire, temp_id, rom=rom, res=CONVERT_RES_FAR)
         self.port = port
         self.temp = None
         self.enabled = False
         self.set = None
         self.relay = None
 
+        # Time of the last temperature reading
+        self._t_temp = None
+
+    # Short read if enabled and the result is plausible, otherwise a full read with CRC.
+    # Returns True if a short read was tried and failed.
+    def read_temperature(self):
+        t = time.monotonic()
+        fallback = False
+        if SHORT_READ and self.temp is not None:
+            try:
+                temp = to_fahrenheit(self.sensor.temperature_short)
+            except OneWireDataError:
+                temp = None
+            if (temp is not None and SHORT_READ_RANGE[0] <= temp <= SHORT_READ_RANGE[1]
+                    and abs(temp - self.temp) <= SHORT_READ_RATE * (t - self._t_temp)):
+                self.temp = temp
+                self._t_temp = t
+                return False
+            fallback = True
+        self.temp = to_fahrenheit(self.sensor.temperature)
+        self._t_temp = t
+        return fallback
+
+    # Full resolution only for enabled control channels near the setpoint
+    def update_resolution(self):
+        near = (self.port is not None and self.enabled and self.set is not None and self.temp is not None
+                and abs(self.temp - self.set) <= CONVERT_RES_BAND)
+        self.sensor.set_resolution(CONVERT_RES_NEAR if near else CONVERT_RES_FAR)
+
     def stat(self):
         return {
             'name': self.name,
@@ -59,32 +168,135 @@ class ControlChannel:
             'temp': self.temp
         }
 
+class AmbientChannel:
+
+    # Auxiliary channel with the BMP280's temperature and pressure
+    def __init__(self, name, temp_id, sensor):
+        self.name = name
+        self.temp_id = temp_id
+        self.sensor = sensor
+        self.onewire = None
+        self.port = None
+        self.temp = None
+        self.pressure = None
+        self.enabled = False
+        self.set = None
+        self.relay = None
+
+    # Latest normal mode result in one 6 byte burst read, pressure in hPa,
+    # returns False when the calibration can't compensate the reading
+    def read(self):
+        result = self.sensor.read_sensor()
+        if result is None:
+            return False
+        pressure, temp = result
+        self.temp = to_fahrenheit(temp)
+        self.pressure = pressure / 100
+        return True
+
+    def stat(self):
+        return {
+            'name': self.name,
+            'temp': self.temp,
+            'pressure': self.pressure
+        }
+
 class Control:
 
-    def __init__(self, msg_queue, rsp_queue):
+    # A simulated bus from control.simulator can be passed in place of the Pi's I2C bus,
+    # each cycle is recorded to the history store and to a sample ring in ring_file if given.
+    # SET changes are saved to startup_file, with None the defaults are only read from
+    # STARTUP_FILE and changes are not saved.
+    def __init__(self, msg_queue, rsp_queue, i2c=None, history=None, ring_file=None, startup_file=STARTUP_FILE):
+
+        self.i2c = CountingI2C(i2c if i2c is not None else i2c_bus())
 
-        self.i2c = busio.I2C(board.SCL, board.SDA)
+        # Each driver has its own handle on the bus, relay writes go ahead of sensor traffic
+        self.arbiter = I2CArbiter(self.i2c)
+        devices = ['mcp23008'] + ['ds2482-%02x' % address for address in sorted(set(
+            address for address, channel in ONEWIRE_BUSES.values()))]
+        if BMP280_ADDRESS is not None:
+            devices.append('bmp280')
+
+        # Counters and histograms, shared with the web process when created before the fork
+        self.metrics = Metrics(
+            sensors=[temp_id for name, temp_id, port, bus in CHAN_PARAMS],
+            chans=[name for name, temp_id, port, bus in CHAN_PARAMS if port is not None],
+            devices=devices,
+            aux_sensors=[AMBIENT_ID] if BMP280_ADDRESS is not None else [])
 
         # Initialize the GPIO, relays off (ports are active low), configure as outputs
-        self.gpio = MCP23008(self.i2c)
+        self.gpio_i2c = self.arbiter.device('mcp23008', PRIORITY_RELAY)
+        self.gpio = MCP23008(self.gpio_i2c)
         self.gpio.output_high(RELAY_MASK).config_output(RELAY_MASK)
 
-        # Initialize the 1-wire bus and temperature sensors
-        self.onewire = DS2482(self.i2c, active_pullup=True)
+        # The reader threads switch relays as their channels are read, one at a time
+        self._relay_lock = threading.Lock()
+
+        # Initialize the 1-wire buses and temperature sensors, one DS2482 per address
+        masters = {}
+        handles = {}
+        self.buses = {}
+        self.onewire_i2c = {}
+        for bus, (address, channel) in ONEWIRE_BUSES.items():
+            if address not in masters:
+                handles[address] = self.arbiter.device('ds2482-%02x' % address, PRIORITY_CONTROL)
+                masters[address] = DS2482(handles[address], address, active_pullup=True)
+            self.buses[bus] = masters[address] if channel is None else masters[address].channel(channel)
+            self.onewire_i2c[self.buses[bus]] = handles[address]
+        self.onewire = self.buses[CHAN_PARAMS[0][3]]
+        self.sensor_roms = self.discover_sensors(SENSOR_CACHE)
+
+        # A reader thread per DS2482, while one waits on its 1-Wire bus the others use the
+        # I2C bus. The threads are started on first use, after any fork.
+        self._readers = ThreadPoolExecutor(max_workers=len(masters), thread_name_prefix='seedling-1wire')
 
         # Initialize the control and auxiliary temperature channels
         self.ctl_chan = {}
         self.aux_chan = {}
-        for name, temp_id, port in CHAN_PARAMS :
+        for name, temp_id, port, bus in CHAN_PARAMS :
+            rom = self.sensor_roms[temp_id]
             if port is None:
-                self.aux_chan[name] = ControlChannel(name, temp_id, self.onewire)
+                self.aux_chan[name] = ControlChannel(name, temp_id, self.buses[bus], rom=rom)
+            else:
+                self.ctl_chan[name] = ControlChannel(name, temp_id, self.buses[bus], port, rom=rom)
+
+        # Ambient channel if there is a BMP280, sampled continuously
+        self.ambient = None
+        if BMP280_ADDRESS is not None:
+            try:
+                bmp = BMP280(self.arbiter.device('bmp280', PRIORITY_AUX), BMP280_ADDRESS)
+            except ValueError as e:
+                print('seedling control: No BMP280 at %02X: %s' % (BMP280_ADDRESS, e))
             else:
-                self.ctl_chan[name] = ControlChannel(name, temp_id, self.onewire, port)
+                bmp.normal_mode(BMP280_OS_MODE, BMP280_STANDBY, BMP280_FILTER)
+                self.ambient = self.aux_chan[AMBIENT_CHAN] = AmbientChannel(AMBIENT_CHAN, AMBIENT_ID, bmp)
 
         self.msg_queue = msg_queue
         self.rsp_queue = rsp_queue
+        self.history = history
+
+        # Message taken from the queue while draining SETs, processed next
+        self._held = []
+
+        # The asyncio engine's pending read of the message queue
+        self._reader = None
 
-        self.load_defaults(STARTUP_FILE)
+        # Control cycles completed
+        self._cycles = 0
+
+        self.startup_file = startup_file
+        self.load_defaults(startup_file if startup_file is not None else STARTUP_FILE)
+
+        # Channel status snapshot in shared memory, read by the web process without a message round trip
+        self.status = StatusBlock(len(self.ctl_chan) + len(self.aux_chan))
+        self.publish()
+
+        # Recent samples, memory mapped and shared with the web process
+        self.ring = None
+        if ring_file is not None:
+            names = self.ctl_names + self.aux_names
+            self.ring = SampleRing(ring_file, names, RING_DAYS * 86400 // CYCLE_TIME)
 
     # Initialize control channels from the startup file
     def load_defaults(self, filename):
@@ -104,10 +316,69 @@ class Control:
 
     # Save control channel configuration to the startup file
     def save_defaults(self, filename):
-        with open(filename, 'w') as f:
-            f.write('# Setpoints at startup\n')
-            for chan in self.ctl_chans:
-                f.write(('%s:%d:%s' %(chan.name, chan.set, 'ON' if chan.enabled else 'OFF')))
+        write_atomic(filename, '# Setpoints at startup\n' + ''.join(
+            '%s:%d:%s\n' % (chan.name, chan.set, 'ON' if chan.enabled else 'OFF') for chan in self.ctl_chans))
+
+    # Load cached sensor ROM codes, one sensor ID and 16 hex digit ROM code per line
+    def load_sensors(self, filename):
+        roms = {}
+        if not os.path.exists(filename):
+            return roms
+        with open(filename) as f:
+            regex = re.compile('(\w+):([0-9A-F]{16})')
+            for line in f:
+                line = line.strip().upper()
+                if line.startswith('#') or line == '':
+                    continue
+                try:
+                    temp_id, rom = regex.fullmatch(line).groups()
+                    roms[temp_id] = list(bytes.fromhex(rom))
+                except AttributeError:
+                    print('seedling control: Bad sensor cache entry: %s' % line)
+        return roms
+
+    # Save sensor ROM codes to the cache file
+    def save_sensors(self, filename, roms):
+        write_atomic(filename, '# Sensor ROM codes\n' + ''.join(
+            '%s:%s\n' % (temp_id, bytes(roms[temp_id]).hex().upper()) for temp_id in sorted(roms)))
+
+    # Map sensor IDs to ROM codes. Cached sensors are verified individually on their
+    # bus, a bus is only searched when one of its channel sensors is missing.
+    def discover_sensors(self, filename):
+        roms = dict(DS18B20_SENSORS)
+        cache = self.load_sensors(filename)
+        roms.update(cache)
+
+        temp_ids = [temp_id for name, temp_id, port, bus in CHAN_PARAMS]
+        for bus, onewire in self.buses.items():
+            missing = [temp_id for name, temp_id, port, chan_bus in CHAN_PARAMS if chan_bus == bus
+                       and (temp_id not in roms or not DS18B20.verify(onewire, roms[temp_id]))]
+            if not missing:
+                continue
+
+            print('seedling control: Sensor search %s, missing: %s' % (bus, ' '.join(missing)))
+            known = list(roms.values())
+            found = [rom for rom in DS18B20.search(onewire) if rom not in known]
+
+            # A single replaced sensor takes over the missing sensor ID
+            if len(missing) == 1 and len(found) == 1:
+                print('seedling control: Sensor %s replaced: %s' % (missing[0], bytes(found[0]).hex().upper()))
+                roms[missing[0]] = found.pop()
+                missing = []
+
+            for rom in found:
+                print('seedling control: Unassigned sensor: %s' % bytes(rom).hex().upper())
+            for temp_id in missing:
+                if temp_id not in roms:
+                    raise OneWireDataError('Sensor not found id=%s' % temp_id)
+                print('seedling control: Sensor not found id=%s' % temp_id)
+
+        # Update the cache with any new or replaced channel sensors
+        update = {temp_id: roms[temp_id] for temp_id in set(cache) | set(temp_ids)}
+        if update != cache:
+            self.save_sensors(filename, update)
+
+        return roms
 
     # Sorted lists of channels and channel names
     @property
@@ -126,95 +397,423 @@ class Control:
     def aux_names(self):
         return sorted(self.aux_chan.keys())
 
+    # Channels with a DS18B20 sensor
+    @property
+    def sensor_chans(self):
+        return [chan for chan in self.ctl_chans + self.aux_chans if chan.onewire is not None]
+
+    # Sensor channels grouped by DS2482 and ordered by bus, one group per reader thread
+    @property
+    def master_chans(self):
+        groups = {}
+        for onewire in self.buses.values():
+            chans = [chan for chan in self.sensor_chans if chan.onewire is onewire]
+            if chans:
+                groups.setdefault(self.onewire_i2c[onewire], []).extend(chans)
+        return list(groups.values())
+
+    # Process a command message, returns the response and True if the control loop should exit
+    def process_msg(self, msg):
+
+        resp = {'error': None}
+        exit_flag = False
+        cmd, *params = msg.strip().upper().split()
+        if cmd == 'STAT':
+            resp.update({
+                'ctl_chans': list(chan.stat() for chan in self.ctl_chans),
+                'aux_chans': list(chan.stat() for chan in self.aux_chans)
+            })
+        elif cmd == 'END':
+            exit_flag = True
+        elif cmd == 'SET' and params and len(params) % 2 == 0:
+            updates, error = self.parse_set(params)
+            if error:
+                resp.update({'error': error})
+            else:
+                self.apply_set(updates)
+        else:
+            resp.update({'error': 'Bad command: %s' % msg})
+
+        return resp, exit_flag
+
+    # Parse SET channel name and value pairs, returns the updates and any error
+    def parse_set(self, params):
+        updates = []
+        for name, val in zip(params[0::2], params[1::2]):
+            if name not in self.ctl_names:
+                return [], 'Bad control channel name: %s' % name
+            if val in ('ON', 'OFF'):
+                updates.append((name, 'enabled', val == 'ON'))
+            elif val[0] in '+-' and val[1:].isdigit():
+                updates.append((name, 'delta', int(val)))
+            elif val.isdigit():
+                updates.append((name, 'set', int(val)))
+            else:
+                return [], 'Bad SET parameter: %s' % val
+        return updates, None
+
+    # Apply SET updates, updates to the same channel collapse into one net change
+    def apply_set(self, updates):
+        net = {}
+        for name, kind, val in updates:
+            chan_net = net.setdefault(name, {})
+            if kind == 'delta':
+                chan_net['delta'] = chan_net.get('delta', 0) + val
+            else:
+                if kind == 'set':
+                    chan_net.pop('delta', None)
+                chan_net[kind] = val
+
+        for name, chan_net in net.items():
+            chan = self.ctl_chan[name]
+            chan.enabled = chan_net.get('enabled', chan.enabled)
+            chan.set = chan_net.get('set', chan.set) + chan_net.get('delta', 0)
+
+        if net and self.startup_file is not None:
+            self.save_defaults(self.startup_file)
+
+    # Process a burst of SET messages as one net update, returns a response per message
+    def process_set_batch(self, msgs):
+        resps = []
+        updates = []
+        for msg in msgs:
+            params = msg.strip().upper().split()[1:]
+            if params and len(params) % 2 == 0:
+                msg_updates, error = self.parse_set(params)
+            else:
+                msg_updates, error = [], 'Bad command: %s' % msg
+            updates.extend(msg_updates)
+            resps.append({'error': error})
+        self.apply_set(updates)
+        return resps
+
+    # Unpack a queued message. Messages from the web process carry a request ID
+    # returned with the response and the time they were queued.
+    def unpack_msg(self, msg):
+        req_id = None
+        if isinstance(msg, tuple):
+            req_id, t_queued, msg = msg
+            self.metrics.queue_seconds.observe(time.monotonic() - t_queued)
+        self.metrics.messages.inc()
+        return req_id, msg
+
+    # Next request ID and message, a message held back from the last SET batch comes first
+    def next_msg(self, timeout):
+        if self._held:
+            return self._held.pop()
+        return self.unpack_msg(self.msg_queue.get(timeout=timeout))
+
+    # Drain the SET messages queued behind a SET, any other message is held for next_msg
+    def drain_sets(self):
+        batch = []
+        while not self._held:
+            try:
+                req_id, msg = self.unpack_msg(self.msg_queue.get_nowait())
+            except queue.Empty:
+                break
+            if is_set(msg):
+                batch.append((req_id, msg))
+            else:
+                self._held.append((req_id, msg))
+        return batch
+
+    # Process a message, a SET together with the SETs queued behind it, and reply once the
+    # change is published. Returns True if the control loop should exit.
+    def handle_msg(self, req_id, msg):
+        exit_flag = False
+        if is_set(msg):
+            # Collapse a burst of SETs into one update before acknowledging
+            batch = [(req_id, msg)] + self.drain_sets()
+            resps = self.process_set_batch([msg for req_id, msg in batch])
+            self.metrics.set_batches.inc()
+            replies = [(req_id, resp) for (req_id, msg), resp in zip(batch, resps)]
+        else:
+            resp, exit_flag = self.process_msg(msg)
+            replies = [(req_id, resp)]
+
+        self.publish()
+        for req_id, resp in replies:
+            self.rsp_queue.put(resp if req_id is None else (req_id, resp))
+        return exit_flag
+
+    # Publish channel status to the shared memory snapshot
+    def publish(self):
+        self.status.publish(self.ctl_chans, self.aux_chans)
+
+    # Start temperature conversions on every bus, returns the time the results will be ready.
+    # Each bus converts while the next is started.
+    def start_conversion(self):
+        self._t_convert = time.monotonic()
+        self._transactions = self.i2c.transactions
+        t_ready = self._t_convert
+        if CONVERT_BROADCAST:
+            for bus, onewire in self.buses.items():
+                sensors = [chan.sensor for chan in self.ctl_chans + self.aux_chans if chan.onewire is onewire]
+                if sensors:
+                    t_ready = max(t_ready, DS18B20.convert_all(onewire, sensors))
+        return t_ready
+
+    # Read one channel's temperature, returns False on a sensor error
+    def read_channel(self, chan):
+        metrics = self.metrics
+        t = time.monotonic()
+        try:
+            # Auxiliary sensors give way to control sensors on the bus
+            with self.onewire_i2c[chan.onewire].at(PRIORITY_AUX if chan.port is None else PRIORITY_CONTROL):
+                fallback = chan.read_temperature()
+            if fallback:
+                metrics.short_read_fallbacks[chan.temp_id].inc()
+        except OneWireDataError as e:
+            if isinstance(e, OneWireCRCError):
+                metrics.crc_errors[chan.temp_id].inc()
+            metrics.sensor_errors[chan.temp_id].inc()
+            print('seedling control: DS18b20 measurement error: %s' % e)
+            return False
+        metrics.read_seconds[chan.temp_id].observe(time.monotonic() - t)
+        return True
+
+    # Read the channels on one DS2482 in turn, a control channel's relay is switched as soon
+    # as its sensor is read. Returns False on a sensor error.
+    def read_chans(self, chans):
+        metrics = self.metrics
+        for chan in chans:
+            if not CONVERT_BROADCAST:
+                t = time.monotonic()
+                chan.sensor.convert_t()
+                chan.onewire.wait_ready()
+                metrics.conversion_seconds[chan.temp_id].observe(time.monotonic() - t)
+            if not self.read_channel(chan):
+                return False
+            if chan.port is not None:
+                self.actuate(chan)
+        return True
+
+    # Switch a control channel's relay from its new temperature. The write is at relay
+    # priority, ahead of the sensor transactions the other reader threads have waiting.
+    def actuate(self, chan):
+        with self._relay_lock:
+            # Current output from the driver's shadow register, ports are active low
+            relay = not self.gpio.olat(chan.port)
+            if not chan.enabled:
+                # Ensure disabled channels are OFF
+                relay = False
+            elif chan.temp < chan.set - HYSTERESIS:
+                relay = True
+            elif chan.temp > chan.set + HYSTERESIS:
+                relay = False
+
+            # Update channel relay status
+            if chan.relay is not None and relay != chan.relay:
+                self.metrics.relay_switches[chan.name].inc()
+            chan.relay = relay
+            self.gpio.olat(chan.port, 0 if relay else chan.port)
+
+    # Read every DS2482's channels, each in its reader thread so their transactions interleave
+    # on the I2C bus. A single DS2482 is read here, which keeps the simulations on the virtual
+    # clock in one thread. Returns False on a sensor error.
+    def read_masters(self):
+        groups = self.master_chans
+        if len(groups) == 1:
+            return self.read_chans(groups[0])
+        return all(list(self._readers.map(self.read_chans, groups)))
+
+    # Read the BMP280, returns False on a bus error
+    def read_ambient(self):
+        metrics = self.metrics
+        t = time.monotonic()
+        try:
+            if not self.ambient.read():
+                raise ValueError('compensation failed')
+        except (OSError, ValueError) as e:
+            metrics.sensor_errors[AMBIENT_ID].inc()
+            print('seedling control: BMP280 measurement error: %s' % e)
+            return False
+        metrics.read_seconds[AMBIENT_ID].observe(time.monotonic() - t)
+        return True
+
+    # BMP280 task for the asyncio engine, read while the 1-Wire buses convert
+    async def sample_ambient(self):
+        return self.read_ambient()
+
+    # Read the converted temperatures and update the relays, returns False on a sensor error
+    def collect_results(self):
+
+        metrics = self.metrics
+        if CONVERT_BROADCAST:
+            metrics.conversion_seconds['all'].observe(time.monotonic() - self._t_convert)
+
+        # Update temperatures
+        if not self.read_masters():
+            return False
+        if self.ambient is not None and not self.read_ambient():
+            return False
+
+        return self.update_outputs()
+
+    # Finish a cycle once every relay is switched, publish and record it
+    def update_outputs(self):
+
+        metrics = self.metrics
+
+        # Restore the GPIO registers if the device was reset or changed behind our back
+        self._cycles += 1
+        if self._cycles % GPIO_RESYNC_CYCLES == 0:
+            changed = self.gpio.resync(restore=True)
+            if changed:
+                metrics.gpio_resyncs.inc()
+                print('seedling control: GPIO registers restored: %s' % ' '.join('%02X' % reg for reg in changed))
+
+        # Resolution for the next conversion
+        for chan in self.sensor_chans:
+            chan.update_resolution()
+
+        self.publish()
+        if self.history is not None:
+            self.history.append(time.time(), self.ctl_chans + self.aux_chans)
+        if self.ring is not None:
+            self.ring.append(time.time(), self.ctl_chans + self.aux_chans)
+
+        # Bus occupancy by device, counted by the arbiter
+        for name, device in self.arbiter.devices.items():
+            metrics.i2c_busy_seconds[name].inc(device.busy_seconds - metrics.i2c_busy_seconds[name].value)
+            metrics.i2c_wait_seconds[name].inc(device.wait_seconds - metrics.i2c_wait_seconds[name].value)
+
+        metrics.cycle_seconds.observe(time.monotonic() - self._t_convert)
+        metrics.cycle_transactions.observe(self.i2c.transactions - self._transactions)
+        return True
+
     def main_loop(self):
 
         # Time at next instrumentation update
         t = time.monotonic()
         t_next = t - t % CYCLE_TIME
 
+        # Time conversion results are ready, None when no conversion is in progress
+        t_ready = None
+
         exit_flag = False
         while not exit_flag:
 
             # print('seedling control: loop')
 
-            t_wait = t_next - time.monotonic()
+            # Keep serving messages while waiting for the next update or conversion results
+            t_wait = (t_next if t_ready is None else t_ready) - time.monotonic()
 
-            if t_wait > 0:
+            if t_wait > 0 or self._held:
                 # print('seedling control: wait %.3f' % t_wait)
 
                 try:
-                    msg = self.msg_queue.get(timeout=t_wait)
+                    req_id, msg = self.next_msg(max(t_wait, 0))
                 except queue.Empty:
                     # No message, update instrumentation
                     pass
                 else:
                     # Process message then back to top of control loop
                     # print('seedling control: msg=%s' % msg)
-
-                    resp = {'error': None}
-                    cmd, *params = msg.strip().upper().split()
-                    if cmd == 'STAT':
-                        resp.update({
-                            'ctl_chans': list(chan.stat() for chan in self.ctl_chans),
-                            'aux_chans': list(chan.stat() for chan in self.aux_chans)
-                        })
-                    elif cmd == 'END':
-                        exit_flag = True
-                    elif cmd == 'SET' and len(params) == 2:
-                        name, val = params
-                        if name in self.ctl_names:
-                            if val in ('ON', 'OFF'):
-                                self.ctl_chan[name].enabled = (val == 'ON')
-                            elif val.startswith('+') and val[1:].isdigit():
-                                self.ctl_chan[name].set += int(val[1:])
-                            elif val.startswith('-') and val[1:].isdigit():
-                                self.ctl_chan[name].set -= int(val[1:])
-                            elif val.isdigit():
-                                self.ctl_chan[name].set = int(val)
-                            else:
-                                resp.update({'error': 'Bad SET parameter: %s' % val})
-                        else:
-                            resp.update({'error': 'Bad control channel name: %s' % name})
-                    else:
-                        resp.update({'error': 'Bad command: %s' % msg})
-
-                    self.rsp_queue.put(resp)
+                    exit_flag = self.handle_msg(req_id, msg)
                     continue
 
-            # print('seedling control: update')
-
-            # Update temperatures
-            for chan in self.ctl_chans + self.aux_chans:
-                try:
-                    chan.sensor.convert_t()
-                    chan.temp = to_fahrenheit(chan.sensor.temperature)
-                except OneWireDataError as e:
-                    print('seedling control: DS18b20 measurement error: %s' % e)
-                    exit_flag = True
-                    break
-
-            if not exit_flag:
-
-                # Get current outputs and invert to use active high logic
-                relays = ~self.gpio.olat()
-                for chan in self.ctl_chans:
-                    if chan.enabled:
-                        if chan.temp < chan.set - HYSTERESIS:
-                            # Turn the relay port ON
-                            relays |= chan.port
-                        elif chan.temp > chan.set + HYSTERESIS:
-                            # Turn the relay port OFF
-                            relays &= ~chan.port
-                    else:
-                        # Ensure disabled channels are OFF
-                        relays &= ~chan.port
-
-                    # Update channel relay status
-                    chan.relay = (relays & chan.port) != 0
-
-                self.gpio.olat(RELAY_MASK, ~relays & 0xFF)
-
+            if t_ready is None:
+                # print('seedling control: convert')
+                t_ready = self.start_conversion()
+            else:
+                # print('seedling control: update')
+                exit_flag = not self.collect_results()
+                t_ready = None
+                t_next += CYCLE_TIME
+                if time.monotonic() > t_next:
+                    self.metrics.cycle_overruns.inc()
+
+        self.close()
+
+    # Read the channels on one DS2482 a bus at a time, the conversion wait lets the other
+    # tasks run and the sensors are read in the DS2482's reader thread. Returns False on a
+    # sensor error.
+    async def read_master(self, chans):
+        loop = asyncio.get_running_loop()
+        metrics = self.metrics
+        for onewire in dict.fromkeys(chan.onewire for chan in chans):
+            bus_chans = [chan for chan in chans if chan.onewire is onewire]
+
+            # The synchronous convert (channel select, reset) waits out a strong pullup with
+            # a blocking sleep, so await it first; the channels of a DS2482-800 share it
+            if CONVERT_BROADCAST:
+                await onewire.wait_ready_async()
+                t = time.monotonic()
+                t_ready = DS18B20.convert_all(onewire, [chan.sensor for chan in bus_chans])
+                await asyncio.sleep(t_ready - time.monotonic())
+                await onewire.wait_ready_async()
+                metrics.conversion_seconds['all'].observe(time.monotonic() - t)
+
+            if not await loop.run_in_executor(self._readers, self.read_chans, bus_chans):
+                return False
+        return True
+
+    # Control cycle task, every bus is read concurrently then the relays are updated once
+    async def run_cycles(self):
+        t_next = time.monotonic()
+        t_next -= t_next % CYCLE_TIME
+        while True:
+            await asyncio.sleep(t_next - time.monotonic())
+            self._t_convert = time.monotonic()
+            self._transactions = self.i2c.transactions
+            tasks = [self.read_master(chans) for chans in self.master_chans]
+            if self.ambient is not None:
+                tasks.append(self.sample_ambient())
+            results = await asyncio.gather(*tasks)
+            if not all(results) or not self.update_outputs():
+                return
             t_next += CYCLE_TIME
-
+            if time.monotonic() > t_next:
+                self.metrics.cycle_overruns.inc()
+
+    # Command task, the queue is read in a worker thread so the cycle task keeps running.
+    # The read is shielded, cancelling the task leaves it to finish for run_tasks.
+    async def serve_messages(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            self._reader = loop.run_in_executor(None, self.next_msg, MSG_POLL)
+            try:
+                req_id, msg = await asyncio.shield(self._reader)
+            except queue.Empty:
+                continue
+            self._reader = None
+            if self.handle_msg(req_id, msg):
+                return
+
+    # Run the command and control cycle tasks until END or a sensor error ends one of them
+    async def run_tasks(self):
+        tasks = [asyncio.ensure_future(self.serve_messages()), asyncio.ensure_future(self.run_cycles())]
+        done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+
+        # A message the queue reader took as the command task was cancelled is still answered
+        if self._reader is not None:
+            try:
+                self._held.append(await self._reader)
+            except queue.Empty:
+                pass
+            self._reader = None
+        while self._held:
+            self.handle_msg(*self._held.pop())
+
+        for task in done:
+            task.result()
+
+    # The asyncio engine, a drop in for main_loop
+    def main_loop_async(self):
+        asyncio.run(self.run_tasks())
+        self.close()
+
+    # Relays off, the history flushed and the status block this Control created
+    # unlinked when the control loop exits, readers keep their existing mapping
+    def close(self):
         print('seedling control: shutdown')
         self.gpio.output_high(RELAY_MASK).config_input(RELAY_MASK)
+        if self.history is not None:
+            self.history.close()
+        self.status.close()
+        self.status.unlink()
+        self._readers.shutdown()
@@ -5,7 +5,10 @@ COMMAND_ROM_SEARCH          = 0xF0
 COMMAND_ROM_READ            = 0x33
 COMMAND_ROM_MATCH           = 0x55
 COMMAND_ROM_SKIP            = 0xCC
-COMMAND_ROM_SEARCH_ALARM    = 0xF0
+COMMAND_ROM_SEARCH_ALARM    = 0xEC
+
+# DS18B20 family code, first byte of the ROM code
+FAMILY_CODE                 = 0x28
 
 # DS18B20 function commands
 
@@ -84,6 +87,10 @@ class OneWireDataError(Exception):
     pass
 
 
+class OneWireCRCError(OneWireDataError):
+    pass
+
+
 class DS18B20:
 
     @staticmethod
@@ -93,29 +100,59 @@ class DS18B20:
             crc = CRC_LOOKUP[crc ^ b]
         return crc
 
-    def __init__(self, onewire, id=None, res=CONVERT_RES_11_BIT):
+    @staticmethod
+    def search(onewire, alarm=False):
+        """Search the bus for DS18B20 sensors, optionally only those with an alarm condition"""
+        roms = []
+        for rom in onewire.search(COMMAND_ROM_SEARCH_ALARM if alarm else COMMAND_ROM_SEARCH):
+            if DS18B20.calc_crc(rom):
+                hexdata = ':'.join('%02X' % i for i in rom)
+                raise OneWireCRCError('Bad ROM CRC: %s' % hexdata)
+            if rom[0] == FAMILY_CODE:
+                roms.append(list(rom))
+        return roms
+
+    @staticmethod
+    def verify(onewire, rom):
+        """Check a sensor is on the bus without a full search"""
+        return onewire.verify(COMMAND_ROM_SEARCH, rom)
+
+    def __init__(self, onewire, id=None, rom=None, res=CONVERT_RES_11_BIT):
         self._ow = onewire
         self._id = id
-        self._rom = DS18B20_SENSORS[id] if id else None
+        self._rom = rom if rom else DS18B20_SENSORS[id] if id else None
+
+        # ROM command and code sent ahead of every function command
+        self._rom_prefix = bytes([COMMAND_ROM_MATCH]) + bytes(self._rom) if self._rom else bytes([COMMAND_ROM_SKIP])
         self._parasitic = self.parasitic_power
-        self._convert_res = res
+
+        # Selected with overdrive match when the sensor supports it, standard speed otherwise
+        self._overdrive = self._rom is not None and onewire.probe_overdrive(self._rom)
+
+        # Alarm registers and resolution are cached, the scratchpad is only written on a change
+        scratch = self.scratchpad
+        self._alarm = scratch[2:4]
+        self._convert_res = scratch[4] if scratch[4] in CONVERT_TIME else None
         self.set_resolution(res)
 
-    def select(self):
+    def select(self, data=b''):
+        """Address the sensor, data (a function command and its parameters) follows in the same block"""
+        if self._overdrive:
+            self._ow.overdrive_match(self._rom)
+            self._ow.write_block(data)
+            return
         self._ow.wait_ready()
         self._ow.reset()
-        if self._rom:
-            self._ow.write_byte(COMMAND_ROM_MATCH)
-            for b in self._rom:
-                self._ow.write_byte(b)
-        else:
-            self._ow.write_byte(COMMAND_ROM_SKIP)
+        self._ow.write_block(self._rom_prefix + bytes(data))
 
     def set_resolution(self, res):
-        scratch = self.scratchpad[2:5]
-        scratch[2] = res
-        self.scratchpad = scratch
-        self._convert_res = res
+        if res != self._convert_res:
+            self.scratchpad = self._alarm + bytes([res])
+            self._convert_res = res
+
+    @property
+    def resolution(self):
+        return self._convert_res
 
     @property
     def parasitic_power(self):
@@ -126,30 +163,42 @@ class DS18B20:
 
     @property
     def temperature(self):
-        t = int.from_bytes(self.scratchpad[0:2], byteorder='little', signed=True)
+        scratch = self.scratchpad
+        if scratch[4] != self._convert_res and scratch[4] in CONVERT_TIME:
+            # Sensor reset to its EEPROM resolution, set_resolution writes it again
+            self._convert_res = scratch[4]
+        t = int.from_bytes(scratch[0:2], byteorder='little', signed=True)
         if t == 0x0550:
             # Value at power on reset generally indicates conversion error
             raise OneWireDataError('Bad conversion id=%s: 0x0550' % self._id)
         return (t & ~CONVERT_MASK[self._convert_res]) / 16.0
 
+    @property
+    def temperature_short(self):
+        """Temperature from the first two scratchpad bytes, the read ends with a reset
+
+        There is no CRC, check the value is plausible and fall back to temperature.
+        """
+        self.select([COMMAND_READ_SCRATCH])
+        buf = self._ow.read_block(2)
+        self._ow.reset()
+        t = int.from_bytes(buf, byteorder='little', signed=True)
+        if t == 0x0550:
+            raise OneWireDataError('Bad conversion id=%s: 0x0550' % self._id)
+        return (t & ~CONVERT_MASK[self._convert_res]) / 16.0
+
     @property
     def scratchpad(self):
-        self.select()
-        self._ow.write_byte(COMMAND_READ_SCRATCH)
-        buf = bytearray(9)
-        for i in range(9):
-            buf[i] = self._ow.read_byte()
+        self.select([COMMAND_READ_SCRATCH])
+        buf = self._ow.read_block(9)
         if DS18B20.calc_crc(buf):
             hexdata = ':'.join('%02X' % i for i in buf)
-            raise OneWireDataError('Bad CRC id=%s: %s' % (self._id, hexdata))
+            raise OneWireCRCError('Bad CRC id=%s: %s' % (self._id, hexdata))
         return buf
 
     @scratchpad.setter
     def scratchpad(self, data):
-        self.select()
-        self._ow.write_byte(COMMAND_WRITE_SCRATCH)
-        for i in range(3):
-            self._ow.write_byte(data[i])
+        self.select(bytes([COMMAND_WRITE_SCRATCH]) + bytes(data[0:3]))
 
     def copy_scratchpad(self):
         self.select()
@@ -159,8 +208,7 @@ class DS18B20:
             self._ow.write_byte(COMMAND_COPY_SCRATCH)
 
     def recall_scratchpad(self):
-        self.select()
-        self._ow.write_byte(COMMAND_RECALL_EEPROM)
+        self.select([COMMAND_RECALL_EEPROM])
         while self._ow.single_bit() == 0:
             continue
 
@@ -171,16 +219,30 @@ class DS18B20:
         else:
             self._ow.write_byte(COMMAND_CONVERT_T)
 
+    @staticmethod
+    def convert_all(onewire, sensors):
+        """Start a temperature conversion on every sensor on the bus with a single Skip ROM
+
+        Returns the time the results are ready. The bus is only held busy when the
+        strong pullup powers parasitic sensors.
+        """
+        busy = max(CONVERT_TIME[s._convert_res] for s in sensors)
+        parasitic = any(s._parasitic for s in sensors)
+        onewire.wait_ready()
+        onewire.reset()
+        onewire.write_byte(COMMAND_ROM_SKIP)
+        onewire.write_byte(COMMAND_CONVERT_T, strong_pullup=parasitic, busy=busy if parasitic else None)
+        return time.monotonic() + busy
+
     def read_rom(self):
         """Read the 8-byte rom code from a SINGLE DEVICE"""
-        buf = bytearray(8)
-        self.select()
-        self._ow.write_byte(COMMAND_ROM_READ)
-        for i in range(8):
-            buf[i] = self._ow.read_byte()
+        self._ow.wait_ready()
+        self._ow.reset()
+        self._ow.write_block([COMMAND_ROM_READ])
+        buf = self._ow.read_block(8)
         if DS18B20.calc_crc(buf):
             hexdata = ':'.join('%02X' % i for i in buf)
-            raise OneWireDataError('Bad CRC id=%s: %s' % (self._id, hexdata))
+            raise OneWireCRCError('Bad CRC id=%s: %s' % (self._id, hexdata))
         return buf
 
 def to_fahrenheit(t):
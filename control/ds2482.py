@@ -1,4 +1,5 @@
 import time
+import asyncio
 
 import adafruit_bus_device.i2c_device as i2c_device
 
@@ -14,6 +15,16 @@ COMMAND_1W_SINGLE_BIT       = 0x87
 COMMAND_1W_WRITE_BYTE       = 0xA5
 COMMAND_1W_READ_BYTE        = 0x96
 COMMAND_1W_TRIPLET          = 0x78
+COMMAND_CHANNEL_SELECT      = 0xC3
+
+# DS2482-800 channel select codes and the codes read back once selected
+CHANNEL_SELECT              = (0xF0, 0xE1, 0xD2, 0xC3, 0xB4, 0xA5, 0x96, 0x87)
+CHANNEL_READBACK            = (0xB8, 0xB1, 0xAA, 0xA3, 0x9C, 0x95, 0x8E, 0x87)
+
+# 1-Wire overdrive ROM commands, sent at standard speed. Devices without
+# overdrive ignore them and wait for the next standard speed reset.
+COMMAND_ROM_OVERDRIVE_SKIP  = 0x3C
+COMMAND_ROM_OVERDRIVE_MATCH = 0x69
 
 # DS2482 read pointer codes
 POINTER_STATUS              = 0xF0
@@ -37,6 +48,22 @@ STATUS_SINGLE_BIT           = 0x20
 STATUS_TRIPLET_BIT          = 0x40
 STATUS_BRANCH_TAKEN         = 0x80
 
+# 1-Wire reset and time slot durations (secs) at standard and overdrive speed
+ONEWIRE_TIMING = {
+    False:  {'reset': 0.001148, 'slot': 0.0000696},
+    True:   {'reset': 0.000146, 'slot': 0.0000106},
+}
+
+# 1-Wire operations with their duration in time slots, reset counts as one
+ONEWIRE_SLOTS = {
+    'reset':        1,
+    'single_bit':   1,
+    'write_byte':   8,
+    'read_byte':    8,
+    'triplet':      3,
+    'wait_ready':   0,
+}
+
 class DS2482:
 
     def __init__(self, i2c, address=DS2482_ADDRESS, active_pullup=False):
@@ -48,11 +75,42 @@ class DS2482:
         # 1-Wire bus busy with STRONG_PULLUP
         self._bus_busy = time.monotonic()
 
+        # Operations and status polls by 1-Wire operation
+        self.ops = dict.fromkeys(ONEWIRE_SLOTS, 0)
+        self.polls = dict.fromkeys(ONEWIRE_SLOTS, 0)
+
+    @property
+    def busy_until(self):
+        """Monotonic time the strong pullup on the 1-Wire bus is released"""
+        return self._bus_busy
+
     def device_reset(self):
         """Terminate any 1-wire communication and reset the DS2482"""
         with self._i2c as i2c:
             i2c.write(bytes([COMMAND_DEVICE_RESET]))
 
+        # Configuration register, cached so the bus speed is only written when it changes
+        self._config = 0
+
+        # DS2482-800 channel, selected again before the next channel's operation
+        self._channel = None
+
+    def select_channel(self, channel):
+        """Select a DS2482-800 1-Wire channel, waits for any strong pullup on the current one"""
+        if channel == self._channel:
+            return
+        self.wait_ready()
+        with self._i2c as i2c:
+            buf = bytearray([COMMAND_CHANNEL_SELECT, CHANNEL_SELECT[channel]])
+            i2c.write_then_readinto(buf, buf, in_end=1)
+            if buf[0] != CHANNEL_READBACK[channel]:
+                raise OSError('DS2482 channel %d select failed: %02X' % (channel, buf[0]))
+        self._channel = channel
+
+    def channel(self, channel):
+        """The 1-Wire bus on one channel of a DS2482-800"""
+        return DS2482Channel(self, channel)
+
     @property
     def device_status(self):
         with self._i2c as i2c:
@@ -71,17 +129,55 @@ class DS2482:
     def device_config(self, config):
         with self._i2c as i2c:
             i2c.write(bytes([COMMAND_WRITE_CONFIG, (config & 0x0F) | ((~config << 4) & 0xF0)]))
+        self._config = config & CONFIG_MASK & ~CONFIG_STRONG_PULLUP
+
+    @property
+    def overdrive(self):
+        """True when the 1-Wire bus runs at overdrive speed"""
+        return bool(self._config & CONFIG_1W_OVERDRIVE)
 
-    def reset(self):
+    @overdrive.setter
+    def overdrive(self, overdrive):
+        if overdrive != self.overdrive:
+            self.device_config = self._config ^ CONFIG_1W_OVERDRIVE
+
+    def _duration(self, op):
+        timing = ONEWIRE_TIMING[self.overdrive]
+        return timing['reset'] if op == 'reset' else ONEWIRE_SLOTS[op] * timing['slot']
+
+    def _sleep(self, secs):
+        # Sleep within an I2C device block, the I2C bus is released for other devices
+        # meanwhile. The DS2482 keeps its read pointer, the next transaction carries on from it.
+        bus = self._i2c.i2c
+        bus.unlock()
+        time.sleep(secs)
+        while not bus.try_lock():
+            pass
+
+    def _poll(self, i2c, buf, op):
+        # Poll the status register (the read pointer) until the bus is no longer busy
+        while True:
+            i2c.readinto(buf, end=1)
+            self.polls[op] += 1
+            if not buf[0] & STATUS_1W_BUSY:
+                return buf[0]
+            self._sleep(ONEWIRE_TIMING[self.overdrive]['slot'])
+
+    def _wait(self, i2c, buf, op):
+        # Sleep for the expected duration of the 1-Wire operation, then poll
+        duration = self._duration(op)
+        if duration:
+            self._sleep(duration)
+        self.ops[op] += 1
+        return self._poll(i2c, buf, op)
+
+    def reset(self, overdrive=False):
+        """1-Wire reset, a standard speed reset returns every device to standard speed"""
+        self.overdrive = overdrive
         with self._i2c as i2c:
             buf = bytearray([COMMAND_1W_RESET])
             i2c.write(buf)
-            while True:
-                i2c.readinto(buf)
-                if not buf[0] & STATUS_1W_BUSY:
-                    break
-                time.sleep(0.001)
-            return buf[0]
+            return self._wait(i2c, buf, 'reset')
 
     def single_bit(self, bit=1, strong_pullup=False, busy=None):
         with self._i2c as i2c:
@@ -95,11 +191,7 @@ class DS2482:
                 i2c.write(buf)
             buf[0:2] = [COMMAND_1W_SINGLE_BIT, 0x80 if bit else 0x00]
             i2c.write(buf)
-            while True:
-                i2c.readinto(buf, end=1)
-                if not buf[0] & STATUS_1W_BUSY:
-                    break
-                time.sleep(0.001)
+            self._wait(i2c, buf, 'single_bit')
             if busy:
                 self._bus_busy = time.monotonic() + busy
             return buf[0] & STATUS_SINGLE_BIT != 0
@@ -116,11 +208,7 @@ class DS2482:
                 i2c.write(buf)
             buf[0:2] = [COMMAND_1W_WRITE_BYTE, data]
             i2c.write(buf)
-            while True:
-                i2c.readinto(buf, end=1)
-                if buf[0] & STATUS_1W_BUSY == 0:
-                    break
-                time.sleep(0.001)
+            self._wait(i2c, buf, 'write_byte')
             if busy:
                 self._bus_busy = time.monotonic() + busy
 
@@ -128,15 +216,53 @@ class DS2482:
         with self._i2c as i2c:
             buf = bytearray([COMMAND_1W_READ_BYTE, 0x00])
             i2c.write(buf, end=1)
-            while True:
-                i2c.readinto(buf, end=1)
-                if not buf[0] & STATUS_1W_BUSY:
-                    break
-                time.sleep(0.001)
+            self._wait(i2c, buf, 'read_byte')
             buf[0:2] = [COMMAND_SET_POINTER, POINTER_DATA]
             i2c.write_then_readinto(buf, buf, in_end=1)
             return buf[0]
 
+    def write_block(self, data):
+        """Write bytes to the 1-Wire bus, holding the I2C device for the whole block
+
+        Each write byte command is sent once the last should have finished. The DS2482
+        does not acknowledge a command while busy, the status is only polled then.
+        The I2C bus itself is released while each byte is written.
+        """
+        if not data:
+            return
+        duration = self._duration('write_byte')
+        with self._i2c as i2c:
+            buf = bytearray(2)
+            for i, b in enumerate(data):
+                buf[0:2] = [COMMAND_1W_WRITE_BYTE, b]
+                if i:
+                    self._sleep(duration)
+                    try:
+                        i2c.write(buf)
+                    except OSError:
+                        self._poll(i2c, buf, 'write_byte')
+                        buf[0:2] = [COMMAND_1W_WRITE_BYTE, b]
+                        i2c.write(buf)
+                else:
+                    i2c.write(buf)
+                self.ops['write_byte'] += 1
+            self._sleep(duration)
+            self._poll(i2c, buf, 'write_byte')
+
+    def read_block(self, n):
+        """Read bytes from the 1-Wire bus, holding the I2C device for the whole block"""
+        data = bytearray(n)
+        with self._i2c as i2c:
+            buf = bytearray(2)
+            for i in range(n):
+                buf[0] = COMMAND_1W_READ_BYTE
+                i2c.write(buf, end=1)
+                self._wait(i2c, buf, 'read_byte')
+                buf[0:2] = [COMMAND_SET_POINTER, POINTER_DATA]
+                i2c.write_then_readinto(buf, buf, in_end=1)
+                data[i] = buf[0]
+        return data
+
     def wait_ready(self):
         while True:
             t = self._bus_busy - time.monotonic()
@@ -147,15 +273,124 @@ class DS2482:
         with self._i2c as i2c:
             buf = bytearray([COMMAND_SET_POINTER, POINTER_STATUS])
             i2c.write(buf)
-            while True:
-                i2c.readinto(buf, end=1)
-                if not buf[0] & STATUS_1W_BUSY:
-                    break
-                time.sleep(0.001)
-            return buf[0]
+            return self._wait(i2c, buf, 'wait_ready')
+
+    async def wait_ready_async(self):
+        """wait_ready for the asyncio engine, other tasks run until the strong pullup is released"""
+        # Another channel's task may start a conversion while this one sleeps
+        while True:
+            t = self._bus_busy - time.monotonic()
+            if t > 0:
+                await asyncio.sleep(t)
+            else:
+                break
+        return self.wait_ready()
 
     def triplet(self, dir):
-        pass
+        """Generate two read time slots and one write time slot for the ROM search"""
+        with self._i2c as i2c:
+            buf = bytearray([COMMAND_1W_TRIPLET, 0x80 if dir else 0x00])
+            i2c.write(buf)
+            return self._wait(i2c, buf, 'triplet')
+
+    def overdrive_skip(self):
+        """Switch all overdrive capable devices and the bus to overdrive speed
+
+        Falls back to standard speed and returns False if no device answers an
+        overdrive reset.
+        """
+        self.wait_ready()
+        self.reset()
+        self.write_byte(COMMAND_ROM_OVERDRIVE_SKIP)
+        if self.reset(overdrive=True) & STATUS_PRESENCE_PULSE:
+            return True
+        self.reset()
+        return False
+
+    def overdrive_match(self, rom):
+        """Select one device, the ROM code and everything following runs at overdrive speed"""
+        self.wait_ready()
+        self.reset()
+        self.write_byte(COMMAND_ROM_OVERDRIVE_MATCH)
+        self.overdrive = True
+        self.write_block(rom)
+
+    def probe_overdrive(self, rom):
+        """Check the device with the given ROM code supports overdrive, leaves the bus at standard speed"""
+        self.overdrive_match(rom)
+        supported = bool(self.reset(overdrive=True) & STATUS_PRESENCE_PULSE)
+        self.reset()
+        return supported
+
+    def _search_pass(self, command, rom, last_discrepancy):
+        # One pass of the 1-Wire search algorithm. Bits below last_discrepancy follow
+        # the previous ROM code, the bit at last_discrepancy takes the 1 branch.
+        # Returns the last bit position the 0 branch was taken or None if the search fails.
+        self.wait_ready()
+        if not self.reset() & STATUS_PRESENCE_PULSE:
+            return None
+        self.write_byte(command)
+        last_zero = 0
+        for bit in range(64):
+            byte, mask = bit // 8, 1 << bit % 8
+            if bit + 1 < last_discrepancy:
+                dir = rom[byte] & mask
+            else:
+                dir = bit + 1 == last_discrepancy
+            status = self.triplet(dir)
+            if status & STATUS_SINGLE_BIT and status & STATUS_TRIPLET_BIT:
+                # No devices participating in the search
+                return None
+            if status & STATUS_BRANCH_TAKEN:
+                rom[byte] |= mask
+            else:
+                rom[byte] &= ~mask
+                if not status & (STATUS_SINGLE_BIT | STATUS_TRIPLET_BIT):
+                    last_zero = bit + 1
+        return last_zero
+
+    def search(self, command):
+        """Generate the ROM codes of all devices responding to the search command"""
+        rom = bytearray(8)
+        last_discrepancy = 0
+        while True:
+            last_discrepancy = self._search_pass(command, rom, last_discrepancy)
+            if last_discrepancy is None:
+                break
+            yield bytes(rom)
+            if last_discrepancy == 0:
+                break
+
+    def verify(self, command, rom):
+        """Check that the device with the given ROM code is present on the bus"""
+        buf = bytearray(rom)
+        return self._search_pass(command, buf, 65) is not None and buf == bytearray(rom)
+
+
+class DS2482Channel:
+    """One channel of a DS2482-800, the channel is selected before each 1-Wire operation
+
+    The channels share the DS2482's configuration, strong pullup and busy time, a
+    strong pullup on one channel holds off the others.
+    """
+
+    # Operations starting a 1-Wire transaction
+    SELECTING = ('reset', 'single_bit', 'write_byte', 'read_byte', 'write_block', 'read_block',
+                 'triplet', 'overdrive_skip', 'overdrive_match', 'probe_overdrive', 'search', 'verify')
+
+    def __init__(self, master, channel):
+        self.master = master
+        self.number = channel
+
+    def __getattr__(self, name):
+        attr = getattr(self.master, name)
+        if name not in self.SELECTING:
+            return attr
+
+        def op(*args, **kwargs):
+            self.master.select_channel(self.number)
+            return attr(*args, **kwargs)
+        return op
 
 
 if __name__ == '__main__':
@@ -172,4 +407,4 @@ if __name__ == '__main__':
     print('single bit 0: %02x' % ow.single_bit(0))
     print('single bit 1: %02x' % ow.single_bit(1))
 
-    ow.reset_device()
+    ow.device_reset()
@@ -0,0 +1,210 @@
+import os
+import sqlite3
+import collections
+
+# Rollup resolutions (secs)
+HOUR = 3600
+DAY = 86400
+RESOLUTIONS = {'hour': HOUR, 'day': DAY}
+
+# Samples are written in one transaction once this many cycles are buffered
+FLUSH_CYCLES = 60
+
+# After a failed write the flush interval doubles, up to this many times FLUSH_CYCLES
+FLUSH_BACKOFF_MAX = 16
+
+# Most samples kept in memory if the database can't be written
+BUFFER_SAMPLES = 10000
+
+# Raw samples older than this (secs) are pruned, rollups are kept
+RAW_RETENTION = 30 * DAY
+
+# Longest range (secs) served as raw samples, longer raw requests get a rollup
+RAW_SPAN_MAX = DAY
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS samples (
+    t INTEGER NOT NULL,
+    chan TEXT NOT NULL,
+    temp REAL,
+    setpoint INTEGER,
+    relay INTEGER,
+    PRIMARY KEY (chan, t)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS samples_t ON samples (t);
+CREATE TABLE IF NOT EXISTS rollups (
+    res INTEGER NOT NULL,
+    chan TEXT NOT NULL,
+    t INTEGER NOT NULL,
+    n INTEGER NOT NULL,
+    temp_n INTEGER NOT NULL,
+    temp_sum REAL NOT NULL,
+    temp_min REAL,
+    temp_max REAL,
+    set_sum REAL NOT NULL,
+    set_n INTEGER NOT NULL,
+    relay_on INTEGER NOT NULL,
+    relay_n INTEGER NOT NULL,
+    PRIMARY KEY (res, chan, t)
+) WITHOUT ROWID;
+'''
+
+UPSERT_ROLLUP = '''
+INSERT INTO rollups (res, chan, t, n, temp_n, temp_sum, temp_min, temp_max, set_sum, set_n, relay_on, relay_n)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (res, chan, t) DO UPDATE SET
+    n = n + excluded.n,
+    temp_n = temp_n + excluded.temp_n,
+    temp_sum = temp_sum + excluded.temp_sum,
+    temp_min = min(coalesce(temp_min, excluded.temp_min), coalesce(excluded.temp_min, temp_min)),
+    temp_max = max(coalesce(temp_max, excluded.temp_max), coalesce(excluded.temp_max, temp_max)),
+    set_sum = set_sum + excluded.set_sum,
+    set_n = set_n + excluded.set_n,
+    relay_on = relay_on + excluded.relay_on,
+    relay_n = relay_n + excluded.relay_n
+'''
+
+
+def aggregate(samples):
+    """Aggregate samples per rollup bucket, to be merged with the stored rollups"""
+    rollups = {}
+    for t, chan, temp, setpoint, relay in samples:
+        for res in RESOLUTIONS.values():
+            key = (res, chan, t - t % res)
+            r = rollups.get(key)
+            if r is None:
+                r = rollups[key] = [0, 0, 0.0, None, None, 0.0, 0, 0, 0]
+            r[0] += 1
+            if temp is not None:
+                r[1] += 1
+                r[2] += temp
+                r[3] = temp if r[3] is None else min(r[3], temp)
+                r[4] = temp if r[4] is None else max(r[4], temp)
+            if setpoint is not None:
+                r[5] += setpoint
+                r[6] += 1
+            if relay is not None:
+                r[7] += relay
+                r[8] += 1
+    return rollups
+
+
+class History:
+    """Channel temperature, setpoint and relay history in sqlite
+
+    Samples collect in a bounded in-memory buffer and are written in batches, one
+    transaction per flush, along with incremental hourly and daily rollups. The
+    connection is opened on first use so the object can be created before forking.
+    """
+
+    def __init__(self, filename, flush_cycles=FLUSH_CYCLES):
+        self.filename = filename
+        self.flush_cycles = flush_cycles
+        self._buffer = collections.deque(maxlen=BUFFER_SAMPLES)
+        self._cycles = 0
+        self._backoff = 1
+        self._db = None
+
+    @property
+    def db(self):
+        if self._db is None:
+            os.makedirs(os.path.dirname(self.filename), exist_ok=True)
+            db = sqlite3.connect(self.filename)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.executescript(SCHEMA)
+            self._db = db
+        return self._db
+
+    def append(self, t, chans):
+        """Buffer one cycle of channel samples, flushing once enough cycles are buffered"""
+        t = int(t)
+        for chan in chans:
+            relay = None if chan.port is None or chan.relay is None else int(chan.relay)
+            setpoint = chan.set if chan.port is not None else None
+            self._buffer.append((t, chan.name, chan.temp, setpoint, relay))
+        self._cycles += 1
+        if self._cycles >= self.flush_cycles * self._backoff:
+            self.flush()
+
+    def flush(self):
+        if not self._buffer:
+            return
+        samples = list(self._buffer)
+        try:
+            with self.db as db:
+                # One sample per channel and second, the first is kept. Two cycles can fall
+                # in the same second, the rollups only count what the samples table holds.
+                times = [sample[0] for sample in samples]
+                stored = set(db.execute('SELECT chan, t FROM samples WHERE t >= ? AND t <= ?',
+                                        (min(times), max(times))))
+                rows = {}
+                for sample in samples:
+                    key = (sample[1], sample[0])
+                    if key not in stored:
+                        rows.setdefault(key, sample)
+                rows = list(rows.values())
+                db.executemany('INSERT INTO samples VALUES (?, ?, ?, ?, ?)', rows)
+                db.executemany(UPSERT_ROLLUP, [key + tuple(r) for key, r in aggregate(rows).items()])
+                db.execute('DELETE FROM samples WHERE t < ?', (samples[-1][0] - RAW_RETENTION,))
+        except (sqlite3.Error, OSError) as e:
+            # The database or its directory can't be written, keep the samples for later
+            print('seedling control: history write failed: %s' % e)
+            self._cycles = 0
+            self._backoff = min(self._backoff * 2, FLUSH_BACKOFF_MAX)
+            return
+        self._buffer.clear()
+        self._cycles = 0
+        self._backoff = 1
+
+    def close(self):
+        self.flush()
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+
+def pick_resolution(start, end):
+    """Raw samples for short ranges, hourly or daily rollups for longer ones"""
+    span = end - start
+    if span <= 6 * HOUR:
+        return 'raw'
+    elif span <= 14 * DAY:
+        return 'hour'
+    return 'day'
+
+
+def query(db, start, end, res=None):
+    """Channel series between two times (secs since the epoch) as lists per column
+
+    Rollup series give the mean, minimum and maximum temperature, the mean setpoint
+    and the fraction of samples with the relay on for each bucket. Raw requests for
+    more than RAW_SPAN_MAX get the picked rollup, the result's res says which.
+    """
+    if not res or res == 'raw' and end - start > RAW_SPAN_MAX:
+        res = pick_resolution(start, end)
+    chans = {}
+    if res == 'raw':
+        rows = db.execute(
+            'SELECT chan, t, temp, setpoint, relay FROM samples WHERE t >= ? AND t < ? ORDER BY chan, t',
+            (start, end))
+        for chan, t, temp, setpoint, relay in rows:
+            series = chans.setdefault(chan, {'t': [], 'temp': [], 'set': [], 'relay': []})
+            series['t'].append(t)
+            series['temp'].append(temp)
+            series['set'].append(setpoint)
+            series['relay'].append(relay)
+    else:
+        size = RESOLUTIONS[res]
+        rows = db.execute(
+            'SELECT chan, t, temp_n, temp_sum, temp_min, temp_max, set_n, set_sum, relay_n, relay_on '
+            'FROM rollups WHERE res = ? AND t >= ? AND t < ? ORDER BY chan, t',
+            (size, start - start % size, end))
+        for chan, t, temp_n, temp_sum, temp_min, temp_max, set_n, set_sum, relay_n, relay_on in rows:
+            series = chans.setdefault(chan, {'t': [], 'temp': [], 'min': [], 'max': [], 'set': [], 'relay': []})
+            series['t'].append(t)
+            series['temp'].append(temp_sum / temp_n if temp_n else None)
+            series['min'].append(temp_min)
+            series['max'].append(temp_max)
+            series['set'].append(set_sum / set_n if set_n else None)
+            series['relay'].append(relay_on / relay_n if relay_n else None)
+    return {'start': start, 'end': end, 'res': res, 'chans': chans}
@@ -0,0 +1,140 @@
+import time
+import heapq
+import itertools
+import threading
+import contextlib
+
+
+class CountingI2C:
+    """Wraps a busio.I2C compatible bus and counts transactions and bytes transferred"""
+
+    def __init__(self, i2c):
+        self._i2c = i2c
+        self.transactions = 0
+        self.bytes = 0
+        self.by_address = {}
+
+    def _count(self, address, nbytes):
+        self.transactions += 1
+        self.bytes += nbytes
+        self.by_address[address] = self.by_address.get(address, 0) + 1
+
+    def reset_counts(self):
+        self.transactions = 0
+        self.bytes = 0
+        self.by_address = {}
+
+    def try_lock(self):
+        return self._i2c.try_lock()
+
+    def unlock(self):
+        self._i2c.unlock()
+
+    def writeto(self, address, buffer, *, start=0, end=None):
+        end = len(buffer) if end is None else end
+        self._count(address, end - start)
+        self._i2c.writeto(address, buffer, start=start, end=end)
+
+    def readfrom_into(self, address, buffer, *, start=0, end=None):
+        end = len(buffer) if end is None else end
+        self._count(address, end - start)
+        self._i2c.readfrom_into(address, buffer, start=start, end=end)
+
+    def writeto_then_readfrom(self, address, buffer_out, buffer_in, *,
+                              out_start=0, out_end=None, in_start=0, in_end=None):
+        out_end = len(buffer_out) if out_end is None else out_end
+        in_end = len(buffer_in) if in_end is None else in_end
+        self._count(address, out_end - out_start + in_end - in_start)
+        self._i2c.writeto_then_readfrom(address, buffer_out, buffer_in,
+                                        out_start=out_start, out_end=out_end,
+                                        in_start=in_start, in_end=in_end)
+
+    def __getattr__(self, name):
+        return getattr(self._i2c, name)
+
+
+# Bus priority classes, the waiting device with the lowest value is granted the bus next
+PRIORITY_RELAY = 0
+PRIORITY_CONTROL = 1
+PRIORITY_AUX = 2
+PRIORITY_DIAG = 3
+
+
+class I2CArbiter:
+    """Shares an I2C bus between drivers by priority class, recording each device's bus occupancy
+
+    Give each driver its own handle from device(), the handle's try_lock waits until
+    the bus is free and no higher priority device is waiting, devices in the same
+    class are granted in turn. A device waits for at most the lock held by the device
+    ahead of it, drivers release the bus while waiting on slow devices.
+    """
+
+    def __init__(self, i2c):
+        self._i2c = i2c
+        self._cond = threading.Condition()
+        self._owner = None
+        self._waiting = []
+        self._seq = itertools.count()
+        self.devices = {}
+
+    def device(self, name, priority):
+        """A bus for one driver, its priority class can be changed between operations"""
+        handle = ArbitratedI2C(self, name, priority)
+        self.devices[name] = handle
+        return handle
+
+    def _acquire(self, handle):
+        t = time.monotonic()
+        with self._cond:
+            entry = (handle.priority, next(self._seq), handle)
+            heapq.heappush(self._waiting, entry)
+            while self._owner is not None or self._waiting[0] is not entry:
+                self._cond.wait()
+            heapq.heappop(self._waiting)
+            self._owner = handle
+        while not self._i2c.try_lock():
+            pass
+        handle._t_lock = time.monotonic()
+        handle.wait_seconds += handle._t_lock - t
+        handle.grants += 1
+
+    def _release(self, handle):
+        handle.busy_seconds += time.monotonic() - handle._t_lock
+        self._i2c.unlock()
+        with self._cond:
+            self._owner = None
+            self._cond.notify_all()
+
+
+class ArbitratedI2C:
+    """One driver's view of a bus shared through an I2CArbiter"""
+
+    def __init__(self, arbiter, name, priority):
+        self._arbiter = arbiter
+        self.name = name
+        self.priority = priority
+
+        # Time holding the bus, time waiting for it and the number of times it was granted
+        self.busy_seconds = 0.0
+        self.wait_seconds = 0.0
+        self.grants = 0
+        self._t_lock = None
+
+    def try_lock(self):
+        self._arbiter._acquire(self)
+        return True
+
+    def unlock(self):
+        self._arbiter._release(self)
+
+    @contextlib.contextmanager
+    def at(self, priority):
+        """Operations in the block use another priority class"""
+        saved, self.priority = self.priority, priority
+        try:
+            yield self
+        finally:
+            self.priority = saved
+
+    def __getattr__(self, name):
+        return getattr(self._arbiter._i2c, name)
@@ -1,4 +1,5 @@
 import time
+import threading
 
 import adafruit_bus_device.i2c_device as i2c_device
 
@@ -24,6 +25,12 @@ MCP23008_IOCON_DISSLW   = 0x10      # Slew rate control, 0 => enable output slew
 MCP23008_IOCON_ODR      = 0x04      # Open-drain interrupt output, 1 => open-drain (ignore INTPOL)
 MCP23008_IOCON_INTPOL   = 0x02      # Interrupt polarity, 1 => active high
 
+# Linux GPIO character device with the line wired to the INT output
+INT_CHIP = '/dev/gpiochip0'
+
+# Secs between checks of the INT level in case an edge was missed
+INT_TIMEOUT = 1.0
+
 # Port bit names
 PORT_A0 = 0x01
 PORT_A1 = 0x02
@@ -36,73 +43,166 @@ PORT_A7 = 0x80
 
 class MCP23008(object):
 
+    # Registers the driver keeps shadow copies of
+    SHADOWED = (MCP23008_IODIR, MCP23008_IPOL, MCP23008_GPINTEN, MCP23008_DEFVAL,
+                MCP23008_INTCON, MCP23008_IOCON, MCP23008_GPPU, MCP23008_OLAT)
+
+    # Restore order after a reset: the latch, pullups and polarity are set before
+    # IODIR turns pins into outputs, as output_high().config_output() does at init
+    RESTORE_ORDER = (MCP23008_IOCON, MCP23008_OLAT, MCP23008_GPPU, MCP23008_IPOL,
+                     MCP23008_DEFVAL, MCP23008_INTCON, MCP23008_GPINTEN, MCP23008_IODIR)
+
     def __init__(self, i2c, address=MCP23008_ADDRESS):
         self.gpio = i2c_device.I2CDevice(i2c, address)
-        self.gpio.write(bytes([MCP23008_IOCON, 0]))
+        with self.gpio as gpio:
+            gpio.write(bytes([MCP23008_IOCON, 0]))
+
+        # Register writes are only sent when the value changes, reads come from the shadows
+        self._shadow = {}
+        self.resync()
+
+        # Interrupt handlers and the thread waiting on the INT line
+        self._handlers = []
+        self._watch_stop = threading.Event()
+
+    def _read_registers(self):
+        # Sequential read of IODIR through GPPU, then OLAT. Reading INTCAP or GPIO
+        # would clear a pending interrupt.
+        buf = bytearray(MCP23008_GPPU + 1)
+        olat = bytearray(1)
+        with self.gpio as gpio:
+            gpio.write_then_readinto(bytes([MCP23008_IODIR]), buf)
+            gpio.write_then_readinto(bytes([MCP23008_OLAT]), olat)
+        buf.extend(bytes(MCP23008_OLAT - MCP23008_GPPU - 1) + olat)
+        return {reg: buf[reg] for reg in self.SHADOWED}
+
+    def resync(self, restore=False):
+        """Compare the shadow registers with the device, returns the registers that differ
+
+        The shadows are updated from the device, or with restore the shadow values are
+        written back, e.g. after the device was reset.
+        """
+        regs = self._read_registers()
+        changed = [reg for reg in self.RESTORE_ORDER if reg in self._shadow and regs[reg] != self._shadow[reg]]
+        if restore:
+            with self.gpio as gpio:
+                for reg in changed:
+                    gpio.write(bytes([reg, self._shadow[reg]]))
+        else:
+            self._shadow.update(regs)
+        return changed
+
+    def _write(self, reg, value):
+        value &= 0xFF
+        if value != self._shadow[reg]:
+            with self.gpio as gpio:
+                gpio.write(bytes([reg, value]))
+            self._shadow[reg] = value
+
+    def _update(self, reg, mask, state):
+        self._write(reg, self._shadow[reg] | mask if state else self._shadow[reg] & ~mask)
 
     def input(self):
         buf  = bytearray([MCP23008_GPIO])
-        self.gpio.write_then_readinto(buf, buf)
+        with self.gpio as gpio:
+            gpio.write_then_readinto(buf, buf)
         return buf[0]
 
     def olat(self, mask=0xFF, data=None):
-        buf = bytearray([MCP23008_OLAT,  0x00])
-        self.gpio.write_then_readinto(buf, buf, out_end=1, in_start=1)
         if not data is None:
-            buf[1] = ((buf[1] & ~mask) | (data & mask)) & 0xFF
-            self.gpio.write(buf)
-        return buf[1] & mask
+            self._write(MCP23008_OLAT, (self._shadow[MCP23008_OLAT] & ~mask) | (data & mask))
+        return self._shadow[MCP23008_OLAT] & mask
 
     def output_high(self, mask=0xFF):
-        buf = bytearray([MCP23008_OLAT,  0x00])
-        self.gpio.write_then_readinto(buf, buf, out_end=1, in_start=1)
-        buf[1] |= mask
-        self.gpio.write(buf)
+        self._update(MCP23008_OLAT, mask, True)
         return self
 
     def output_low(self, mask=0xFF):
-        buf = bytearray([MCP23008_OLAT, 0x00])
-        self.gpio.write_then_readinto(buf, buf, out_end=1, in_start=1)
-        buf[1] &= ~mask
-        self.gpio.write(buf)
+        self._update(MCP23008_OLAT, mask, False)
         return self
 
     def config_invert(self, mask=0xFF, state=True):
-        buf = bytearray([MCP23008_IPOL, 0x00])
-        self.gpio.write_then_readinto(buf, buf, out_end=1, in_start=1)
-        if state:
-            buf[1] |= mask
-        else:
-            buf[1] &= ~mask
-        self.gpio.write(buf)
+        self._update(MCP23008_IPOL, mask, state)
         return self
 
     def config_pullup(self, mask=0xFF, state=True):
-        buf = bytearray([MCP23008_GPPU, 0x00])
-        self.gpio.write_then_readinto(buf, buf, out_end=1, in_start=1)
-        if state:
-            buf[1] |= mask
-        else:
-            buf[1] &= ~mask
-        self.gpio.write(buf)
+        self._update(MCP23008_GPPU, mask, state)
         return self
 
     def config_input(self, mask=0xFF):
-        buf = bytearray([MCP23008_IODIR, 0x00])
-        self.gpio.write_then_readinto(buf, buf, out_end=1, in_start=1)
-        buf[1]|= mask
-        self.gpio.write(buf)
+        self._update(MCP23008_IODIR, mask, True)
         return self
 
     def config_output(self, mask=0xFF):
-        buf = bytearray([MCP23008_IODIR, 0x00])
-        self.gpio.write_then_readinto(buf, buf, out_end=1, in_start=1)
-        buf[1] &= (~mask & 0xFF)
-        self.gpio.write(buf)
+        self._update(MCP23008_IODIR, mask, False)
+        return self
+
+    def config_interrupt(self, mask=0xFF, state=True, compare=None):
+        """Interrupt on any change of the pins in mask, or on a pin differing from compare
+
+        INT is configured open-drain, active low, so it can be pulled up to the Pi's 3v3.
+        """
+        self._write(MCP23008_IOCON, self._shadow[MCP23008_IOCON] | MCP23008_IOCON_ODR)
+        if compare is not None:
+            self._write(MCP23008_DEFVAL, (self._shadow[MCP23008_DEFVAL] & ~mask) | (compare & mask))
+        self._update(MCP23008_INTCON, mask, state and compare is not None)
+        self._update(MCP23008_GPINTEN, mask, state)
         return self
 
+    def on_change(self, mask, handler):
+        """Call handler(changed, captured) for interrupts flagging any pin in mask"""
+        self._handlers.append((mask, handler))
+        return self
+
+    def service_interrupt(self):
+        """Read the interrupt flags and captured pins, clearing the interrupt, and call the handlers
+
+        Returns the flags and captured pins, both read in one transaction.
+        """
+        buf = bytearray(2)
+        with self.gpio as gpio:
+            gpio.write_then_readinto(bytes([MCP23008_INTF]), buf)
+        intf, intcap = buf
+        if intf:
+            for mask, handler in self._handlers:
+                if intf & mask:
+                    handler(intf & mask, intcap)
+        return intf, intcap
+
+    def watch_interrupts(self, line, chip=INT_CHIP):
+        """Service interrupts from a thread waiting on falling edges of the INT line
+
+        Needs the gpiod (v2) bindings. There is no bus traffic until an edge arrives.
+        """
+        import gpiod
+        from gpiod.line import Bias, Edge
+
+        request = gpiod.request_lines(chip, consumer='seedling', config={
+            line: gpiod.LineSettings(edge_detection=Edge.FALLING, bias=Bias.PULL_UP)})
+        self._watch_stop.clear()
+        thread = threading.Thread(target=self._watch, args=(request, line), daemon=True)
+        thread.start()
+        return thread
+
+    def stop_interrupts(self):
+        self._watch_stop.set()
+
+    def _watch(self, request, line):
+        from gpiod.line import Value
+
+        with request:
+            # An interrupt pending before the first wait holds INT low without an edge
+            self.service_interrupt()
+            while not self._watch_stop.is_set():
+                if request.wait_edge_events(INT_TIMEOUT):
+                    request.read_edge_events()
+                    self.service_interrupt()
+                elif request.get_value(line) == Value.INACTIVE:
+                    self.service_interrupt()
+
 
 if __name__ == '__main__':
+    import sys
     import board
     import busio
 
@@ -129,6 +229,13 @@ if __name__ == '__main__':
     mcp.config_input(KILL_SENSE).config_invert(KILL_SENSE).config_pullup(KILL_SENSE)
     mcp.config_output(KILL_BIAS).config_output(KILL_BIAS).output_low(KILL_BIAS)
 
+    # with the INT line number given the kill switch interrupts rather than being polled
+    killed = threading.Event()
+    if len(sys.argv) > 1:
+        mcp.on_change(KILL_SENSE, lambda changed, pins: pins & KILL_SENSE and killed.set())
+        mcp.config_interrupt(KILL_SENSE)
+        mcp.watch_interrupts(int(sys.argv[1]))
+
     # relays off (high), configure as outputs
     mcp.output_high(RELAYS).config_output(RELAYS)
 
@@ -136,7 +243,7 @@ if __name__ == '__main__':
     done = 0
     while True:
 
-        if mcp.input() & KILL_SENSE:
+        if killed.is_set() or len(sys.argv) == 1 and mcp.input() & KILL_SENSE:
             print('pins: %02x' % mcp.input())
             done = 1
 
@@ -156,5 +263,6 @@ if __name__ == '__main__':
             done = 1
 
     # reset the device
+    mcp.stop_interrupts()
     mcp.output_high(RELAYS)  # relays off (high)
     mcp.config_input(0xFF)  # all inputs
@@ -0,0 +1,138 @@
+import bisect
+import multiprocessing
+
+# Histogram bucket upper bounds (secs)
+CYCLE_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+QUEUE_BUCKETS = (0.0001, 0.001, 0.01, 0.1, 0.5, 1.0, 5.0)
+CONVERSION_BUCKETS = (0.1, 0.2, 0.3, 0.4, 0.5, 0.75, 1.0, 2.0)
+
+# Histogram bucket upper bounds (transactions)
+TRANSACTION_BUCKETS = (50, 100, 200, 400, 800, 1600)
+
+
+class Counter:
+
+    def __init__(self, metrics, offset):
+        self._metrics = metrics
+        self._offset = offset
+
+    def inc(self, n=1):
+        self._metrics.values[self._offset] += n
+
+    @property
+    def value(self):
+        return self._metrics.values[self._offset]
+
+
+class Histogram:
+
+    # Slots are the per-bucket counts with a final +Inf bucket, then the sum and count
+    def __init__(self, metrics, offset, buckets):
+        self._metrics = metrics
+        self._offset = offset
+        self.buckets = buckets
+
+    def observe(self, value):
+        values = self._metrics.values
+        values[self._offset + bisect.bisect_left(self.buckets, value)] += 1
+        values[self._offset + len(self.buckets) + 1] += value
+        values[self._offset + len(self.buckets) + 2] += 1
+
+    @property
+    def count(self):
+        return self._metrics.values[self._offset + len(self.buckets) + 2]
+
+
+class Metrics:
+    """Control loop counters and histograms in memory shared with the web process
+
+    The layout is fixed when created, create before forking the control and web
+    processes. Only the control process writes, readers see each value atomically
+    but a scrape can straddle an update. Auxiliary sensors such as the BMP280 only
+    have the read latency and error series, the others are DS18B20 specific.
+    """
+
+    def __init__(self, sensors=(), chans=(), devices=(), aux_sensors=()):
+        self._families = []
+        self._size = 0
+
+        self.cycle_seconds = self._histogram(
+            'seedling_cycle_duration_seconds', 'Control cycle duration from conversion start to relay update',
+            CYCLE_BUCKETS)
+        self.cycle_overruns = self._counter(
+            'seedling_cycle_overruns_total', 'Control cycles finishing after the next cycle was due')
+        self.cycle_transactions = self._histogram(
+            'seedling_cycle_i2c_transactions', 'I2C transactions per control cycle', TRANSACTION_BUCKETS)
+        self.conversion_seconds = self._histogram(
+            'seedling_conversion_seconds', 'Temperature conversion latency', CONVERSION_BUCKETS,
+            'sensor', ('all',) + tuple(sensors))
+        self.read_seconds = self._histogram(
+            'seedling_sensor_read_seconds', 'Sensor read latency', LATENCY_BUCKETS,
+            'sensor', tuple(sensors) + tuple(aux_sensors))
+        self.crc_errors = self._counter(
+            'seedling_crc_errors_total', 'Sensor reads failing the CRC check', 'sensor', sensors)
+        self.short_read_fallbacks = self._counter(
+            'seedling_short_read_fallbacks_total', 'Short sensor reads failing the plausibility check',
+            'sensor', sensors)
+        self.sensor_errors = self._counter(
+            'seedling_sensor_errors_total', 'Sensor reads failing for any reason', 'sensor',
+            tuple(sensors) + tuple(aux_sensors))
+        self.queue_seconds = self._histogram(
+            'seedling_queue_wait_seconds', 'Time command messages wait in the message queue', QUEUE_BUCKETS)
+        self.messages = self._counter(
+            'seedling_messages_total', 'Command messages processed')
+        self.set_batches = self._counter(
+            'seedling_set_batches_total', 'Net SET updates applied for one or more coalesced SET messages')
+        self.gpio_resyncs = self._counter(
+            'seedling_gpio_resyncs_total', 'GPIO register checks finding and restoring changed registers')
+        self.relay_switches = self._counter(
+            'seedling_relay_switches_total', 'Relay state changes', 'chan', chans)
+        self.i2c_busy_seconds = self._counter(
+            'seedling_i2c_busy_seconds_total', 'Time each device held the I2C bus', 'device', devices)
+        self.i2c_wait_seconds = self._counter(
+            'seedling_i2c_wait_seconds_total', 'Time each device waited for the I2C bus', 'device', devices)
+
+        self.values = multiprocessing.RawArray('d', self._size)
+
+    def _add(self, name, kind, help, label, label_values, make, nslots):
+        family = {'name': name, 'type': kind, 'help': help, 'label': label, 'metrics': {}}
+        for value in (label_values if label else (None,)):
+            family['metrics'][value] = make(self, self._size)
+            self._size += nslots
+        self._families.append(family)
+        return family['metrics'] if label else family['metrics'][None]
+
+    def _counter(self, name, help, label=None, label_values=()):
+        return self._add(name, 'counter', help, label, label_values, Counter, 1)
+
+    def _histogram(self, name, help, buckets, label=None, label_values=()):
+        return self._add(name, 'histogram', help, label, label_values,
+                         lambda metrics, offset: Histogram(metrics, offset, buckets), len(buckets) + 3)
+
+    def render(self):
+        """Prometheus text exposition format"""
+        values = self.values[:]
+        lines = []
+        for family in self._families:
+            name = family['name']
+            lines.append('# HELP %s %s' % (name, family['help']))
+            lines.append('# TYPE %s %s' % (name, family['type']))
+            for label_value, metric in family['metrics'].items():
+                labels = '%s="%s"' % (family['label'], label_value) if family['label'] else ''
+                if family['type'] == 'counter':
+                    lines.append('%s%s %s' % (name, '{%s}' % labels if labels else '', _fmt(values[metric._offset])))
+                    continue
+                n = len(metric.buckets)
+                total = 0
+                for i, le in enumerate(metric.buckets + ('+Inf',)):
+                    total += values[metric._offset + i]
+                    le = le if isinstance(le, str) else _fmt(le)
+                    lines.append('%s_bucket{%sle="%s"} %s' % (name, labels + ',' if labels else '', le, _fmt(total)))
+                lines.append('%s_sum%s %s' % (name, '{%s}' % labels if labels else '', _fmt(values[metric._offset + n + 1])))
+                lines.append('%s_count%s %s' % (name, '{%s}' % labels if labels else '', _fmt(values[metric._offset + n + 2])))
+        return '\n'.join(lines) + '\n'
+
+
+def _fmt(value):
+    return '%d' % value if value == int(value) else repr(value)
@@ -0,0 +1,246 @@
+import math
+import queue
+import heapq
+import itertools
+
+import control.control as control
+import control.ds2482 as ds2482
+import control.ds18b20 as ds18b20
+import control.mcp23008 as mcp23008
+import control.i2cbus as i2cbus
+from control.ds18b20 import to_fahrenheit
+from control.simulator import seedling_bus
+
+# Modules whose time functions are replaced by the virtual clock
+CLOCKED_MODULES = (control, ds2482, ds18b20, mcp23008, i2cbus)
+
+# Heat mat and seedling tray thermal parameters, a mat node heated by the relay
+# coupled to a tray node read by the sensor, both losing heat to ambient
+MAT_POWER = 20.0            # W
+MAT_CAPACITY = 2000.0       # J/K
+TRAY_CAPACITY = 20000.0     # J/K
+MAT_TO_TRAY = 2.0           # W/K
+MAT_TO_AMBIENT = 0.5        # W/K
+TRAY_TO_AMBIENT = 0.3       # W/K
+
+# Ambient temperature (deg C), daily swing with the low at midnight
+AMBIENT_MEAN = 18.0
+AMBIENT_SWING = 3.0
+
+# Integration step (secs)
+STEP_TIME = 5.0
+
+
+class VirtualClock:
+    """Stand-in for the time module, sleeping advances the clock without waiting"""
+
+    def __init__(self, start=0.0):
+        self.now = start
+        self._saved = None
+
+    def monotonic(self):
+        return self.now
+
+    def time(self):
+        return self.now
+
+    def sleep(self, secs):
+        if secs > 0:
+            self.now += secs
+
+    def advance_to(self, t):
+        self.now = max(self.now, t)
+
+    def install(self, modules=CLOCKED_MODULES):
+        """Replace the time module in the control modules with the virtual clock"""
+        self._saved = [(m, m.time) for m in modules]
+        for m in modules:
+            m.time = self
+        return self
+
+    def uninstall(self):
+        for m, t in self._saved:
+            m.time = t
+        self._saved = None
+
+    def __enter__(self):
+        return self.install()
+
+    def __exit__(self, *exc):
+        self.uninstall()
+
+
+class VirtualQueue:
+    """Message queue on the virtual clock, messages are scheduled for delivery at a time"""
+
+    def __init__(self, clock):
+        self.clock = clock
+        self._msgs = []
+        self._seq = itertools.count()
+
+    def put_at(self, t, msg):
+        heapq.heappush(self._msgs, (t, next(self._seq), msg))
+
+    def put(self, msg):
+        self.put_at(self.clock.monotonic(), msg)
+
+    def get(self, block=True, timeout=None):
+        t_end = self.clock.monotonic() + (timeout or 0)
+        if self._msgs and self._msgs[0][0] <= t_end:
+            t, seq, msg = heapq.heappop(self._msgs)
+            self.clock.advance_to(t)
+            return msg
+        self.clock.advance_to(t_end)
+        raise queue.Empty
+
+    def get_nowait(self):
+        return self.get(timeout=0)
+
+
+class ThermalChannel:
+    """Heat mat and tray for one control channel"""
+
+    def __init__(self, name, port, temp):
+        self.name = name
+        self.port = port
+        self.mat_temp = temp
+        self.tray_temp = temp
+
+        # Statistics
+        self.on_time = 0.0
+        self.total_time = 0.0
+        self.switches = 0
+        self.relay = False
+        self.setpoint = None
+        self.max_error = None
+        self.min_error = None
+        self.abs_error = 0.0
+        self.error_time = 0.0
+
+    def step(self, dt, relay, ambient, measure=False):
+        if measure and self.setpoint is not None:
+            error = to_fahrenheit(self.tray_temp) - self.setpoint
+            self.max_error = error if self.max_error is None else max(self.max_error, error)
+            self.min_error = error if self.min_error is None else min(self.min_error, error)
+            self.abs_error += abs(error) * dt
+            self.error_time += dt
+        power = MAT_POWER if relay else 0.0
+        q_tray = MAT_TO_TRAY * (self.mat_temp - self.tray_temp)
+        q_mat = power - q_tray - MAT_TO_AMBIENT * (self.mat_temp - ambient)
+        self.mat_temp += q_mat * dt / MAT_CAPACITY
+        self.tray_temp += (q_tray - TRAY_TO_AMBIENT * (self.tray_temp - ambient)) * dt / TRAY_CAPACITY
+        if relay:
+            self.on_time += dt
+        self.total_time += dt
+
+
+class ThermalPlant:
+    """Thermal model behind the simulated sensors, heat mats follow the relay outputs"""
+
+    def __init__(self, clock, gpio, settle=0.0):
+        self.clock = clock
+        self.gpio = gpio
+        self.chans = {}
+        self.t = clock.monotonic()
+
+        # Errors from setpoint are measured after the settling time
+        self.settle = self.t + settle
+
+    def add_channel(self, name, port):
+        chan = ThermalChannel(name, port, self.ambient(self.t))
+        self.chans[name] = chan
+        return chan
+
+    def ambient(self, t):
+        return AMBIENT_MEAN - AMBIENT_SWING * math.cos(2 * math.pi * (t % 86400) / 86400)
+
+    def advance(self):
+        # Relays are active low, the state set at the last relay update holds since the last advance
+        outputs = self.gpio.outputs
+        for chan in self.chans.values():
+            relay = not outputs & chan.port
+            if relay != chan.relay:
+                chan.switches += 1
+                chan.relay = relay
+        now = self.clock.monotonic()
+        while self.t < now:
+            dt = min(STEP_TIME, now - self.t)
+            ambient = self.ambient(self.t)
+            for chan in self.chans.values():
+                chan.step(dt, chan.relay, ambient, measure=self.t >= self.settle)
+            self.t += dt
+
+    def temperature(self, name):
+        self.advance()
+        return self.chans[name].tray_temp
+
+    def ambient_temperature(self):
+        self.advance()
+        return self.ambient(self.t)
+
+
+def simulate(days=1.0, setpoints=None, settle=6 * 3600):
+    """Run the control loop against the thermal plant on a virtual clock
+
+    Setpoints (deg F) default to the startup file, all control channels are enabled.
+    Returns per-channel duty cycle, overshoot and switching statistics, errors are
+    measured after the initial settling time.
+    """
+    clock = VirtualClock()
+    i2c, devices = seedling_bus(clock)
+    plant = ThermalPlant(clock, devices['mcp23008'], settle=settle)
+
+    for name, temp_id, port, bus in control.CHAN_PARAMS:
+        if port is None:
+            devices[temp_id].temperature = plant.ambient_temperature
+        else:
+            plant.add_channel(name, port)
+            devices[temp_id].temperature = lambda name=name: plant.temperature(name)
+
+    msg_queue = VirtualQueue(clock)
+    rsp_queue = queue.Queue()
+    duration = days * 86400
+
+    with clock:
+        ctl = control.Control(msg_queue, rsp_queue, i2c=i2c, startup_file=None)
+        for ctl_chan in ctl.ctl_chans:
+            if setpoints and ctl_chan.name in setpoints:
+                ctl_chan.set = setpoints[ctl_chan.name]
+            ctl_chan.enabled = True
+            plant.chans[ctl_chan.name].setpoint = ctl_chan.set
+        msg_queue.put_at(duration, 'END')
+        ctl.main_loop()
+        plant.advance()
+
+    report = {'days': days, 'cycles': int(duration // control.CYCLE_TIME), 'chans': {}}
+    for ctl_chan in ctl.ctl_chans:
+        chan = plant.chans[ctl_chan.name]
+        report['chans'][chan.name] = {
+            'set': ctl_chan.set,
+            'duty_cycle': chan.on_time / chan.total_time if chan.total_time else 0.0,
+            'switches': chan.switches,
+            'switches_per_day': chan.switches / days,
+            'overshoot': chan.max_error,
+            'undershoot': -chan.min_error if chan.min_error is not None else None,
+            'mean_abs_error': chan.abs_error / chan.error_time if chan.error_time else None,
+        }
+    return report
+
+
+if __name__ == '__main__':
+
+    import sys
+    import time
+
+    days = float(sys.argv[1]) if len(sys.argv) > 1 else 1.0
+
+    t = time.perf_counter()
+    report = simulate(days)
+    t = time.perf_counter() - t
+
+    print('%.1f days, %d cycles in %.1f secs' % (report['days'], report['cycles'], t))
+    print('chan   set   duty  switches/day  overshoot  undershoot  mean error')
+    for name, chan in sorted(report['chans'].items()):
+        print('%-4s %5d %5.0f%% %13.1f %9.2fF %10.2fF %10.2fF' % (
+            name, chan['set'], chan['duty_cycle'] * 100, chan['switches_per_day'],
+            chan['overshoot'], chan['undershoot'], chan['mean_abs_error']))
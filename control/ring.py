@@ -0,0 +1,161 @@
+import os
+import mmap
+import struct
+
+from control import seqlock
+
+# File header: magic, number of channels, capacity (records), sequence counter,
+# index of the next record to write, number of records held, number of newest records
+# in time order. The channel names follow the header.
+HEADER = struct.Struct('<4sIIIIII')
+NAME = struct.Struct('8s')
+MAGIC = b'SRN2'
+
+# Records are time (secs since the epoch), temperature per channel (centi-degrees) and a
+# relay bitmask of one bit per channel, relay bits of auxiliary channels are always clear
+TIME = struct.Struct('<I')
+
+# Temperature of a channel with no reading
+NO_TEMP = -0x8000
+
+
+class SampleRing:
+    """Fixed size ring of recent channel samples in a memory mapped file
+
+    Records are packed and time ordered so a time range is found by bisection and
+    returned as views of the mapping. Create before forking, both processes share the
+    mapping. The file is reused after a restart if the channel names and capacity match.
+    The sequence counter is odd while a record is being written, readers retry if it
+    changes.
+
+    Bisection relies on the time of day never stepping back. A Pi without an RTC can
+    start with its clock behind the records it wrote before, until NTP sets it. The
+    header counts the newest records in time order, older records are scanned.
+    """
+
+    def __init__(self, filename, names, capacity):
+        self.names = list(names)
+        self.nchans = len(self.names)
+        self.capacity = capacity
+        self.mask_bytes = (self.nchans + 7) // 8
+        self.record = struct.Struct('<I%dh%ds' % (self.nchans, self.mask_bytes))
+        self.data = HEADER.size + self.nchans * NAME.size
+        self.size = self.data + capacity * self.record.size
+        encoded = [NAME.pack(name.encode()) for name in self.names]
+
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        fd = os.open(filename, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            reuse = os.fstat(fd).st_size == self.size
+            if not reuse:
+                os.ftruncate(fd, self.size)
+            self.mm = mmap.mmap(fd, self.size)
+        finally:
+            os.close(fd)
+        self.buf = memoryview(self.mm)
+
+        magic, nchans, capacity, seq, head, count, ordered = HEADER.unpack_from(self.buf, 0)
+        stored = [bytes(self.buf[HEADER.size + i * NAME.size:HEADER.size + (i + 1) * NAME.size])
+                  for i in range(self.nchans)] if reuse else None
+        if (not reuse or magic != MAGIC or nchans != self.nchans or capacity != self.capacity
+                or stored != encoded or seq & 1):
+            HEADER.pack_into(self.buf, 0, MAGIC, self.nchans, self.capacity, 0, 0, 0, 0)
+            self.buf[HEADER.size:self.data] = b''.join(encoded)
+
+    def _offset(self, i):
+        return self.data + i * self.record.size
+
+    def append(self, t, chans):
+        """Add one sample of each channel, overwriting the oldest when full"""
+        temps = []
+        relays = 0
+        for i, chan in enumerate(chans):
+            temps.append(NO_TEMP if chan.temp is None else max(-0x7FFF, min(0x7FFF, round(chan.temp * 100))))
+            if chan.relay:
+                relays |= 1 << i
+        t = int(t)
+        magic, nchans, capacity, seq, head, count, ordered = HEADER.unpack_from(self.buf, 0)
+
+        # A record older than the last starts a new time ordered run
+        ordered = 1 if count and t < self._time(head - 1, 0) else min(ordered + 1, capacity)
+
+        HEADER.pack_into(self.buf, 0, magic, nchans, capacity, (seq + 1) & 0xFFFFFFFF, head, count, ordered)
+        self.record.pack_into(self.buf, self._offset(head), t, *temps, relays.to_bytes(self.mask_bytes, 'little'))
+        HEADER.pack_into(self.buf, 0, magic, nchans, capacity, (seq + 2) & 0xFFFFFFFF,
+                         (head + 1) % capacity, min(count + 1, capacity), ordered)
+
+    def _header(self):
+        return seqlock.read(self._read_header)
+
+    def _read_header(self):
+        magic, nchans, capacity, seq, head, count, ordered = HEADER.unpack_from(self.buf, 0)
+        if not seq & 1:
+            return seq, head, count, ordered
+        return None
+
+    def _time(self, first, i):
+        return TIME.unpack_from(self.buf, self._offset((first + i) % self.capacity))[0]
+
+    def views(self, start=0, end=0xFFFFFFFF):
+        """Views of the records from start up to end (secs since the epoch), oldest first
+
+        A range wrapping the end of the ring comes back as two views, records are not
+        copied. Returns the sequence counter with the views, check it with valid()
+        after using them. Records before the newest time ordered run are all included,
+        they may be outside the range.
+        """
+        seq, head, count, ordered = self._header()
+        first = (head - count) % self.capacity
+
+        # Bisect the time ordered run for the first record at or after start and the first after end
+        unordered = count - ordered
+        lo, hi = unordered, count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._time(first, mid) < start:
+                lo = mid + 1
+            else:
+                hi = mid
+        i = lo if not unordered else 0
+        hi = count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._time(first, mid) <= end:
+                lo = mid + 1
+            else:
+                hi = mid
+        j = lo
+
+        a, b = (first + i) % self.capacity, (first + j) % self.capacity
+        if i == j:
+            return seq, []
+        if a < b:
+            return seq, [self.buf[self._offset(a):self._offset(b)]]
+        return seq, [self.buf[self._offset(a):self._offset(self.capacity)], self.buf[self._offset(0):self._offset(b)]]
+
+    def valid(self, seq):
+        """True if no record was written since the views were taken"""
+        return HEADER.unpack_from(self.buf, 0)[3] == seq
+
+    def samples(self, start=0, end=0xFFFFFFFF):
+        """Time, temperatures and relay states by channel from start up to end"""
+        while True:
+            seq, views = self.views(start, end)
+            t = []
+            chans = {name: {'temp': [], 'relay': []} for name in self.names}
+            series = [chans[name] for name in self.names]
+            for view in views:
+                for t_rec, *temps, relays in self.record.iter_unpack(view):
+                    if not start <= t_rec <= end:
+                        continue
+                    relays = int.from_bytes(relays, 'little')
+                    t.append(t_rec)
+                    for i, temp in enumerate(temps):
+                        series[i]['temp'].append(None if temp == NO_TEMP else temp / 100)
+                        series[i]['relay'].append(bool(relays & 1 << i))
+            if self.valid(seq):
+                return {'t': t, 'chans': chans}
+
+    def close(self):
+        self.buf.release()
+        self.mm.close()
@@ -0,0 +1,24 @@
+import time
+
+# Reader retries before backing off while the control process is writing
+READ_SPIN = 100
+
+# Sleep (secs) between retries once backing off
+READ_BACKOFF = 0.0001
+
+
+def read(attempt):
+    """Reader side of a shared memory block with a sequence counter
+
+    The writer keeps the counter odd while it updates the block. attempt() reads the
+    block and returns None if the counter was odd or changed meanwhile, it is retried
+    until it gets a consistent result.
+    """
+    spin = 0
+    while True:
+        result = attempt()
+        if result is not None:
+            return result
+        spin += 1
+        if spin > READ_SPIN:
+            time.sleep(READ_BACKOFF)
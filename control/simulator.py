@@ -0,0 +1,707 @@
+import time
+
+from control.ds2482 import DS2482_ADDRESS
+from control.ds2482 import COMMAND_DEVICE_RESET, COMMAND_SET_POINTER, COMMAND_WRITE_CONFIG
+from control.ds2482 import COMMAND_1W_RESET, COMMAND_1W_SINGLE_BIT, COMMAND_1W_WRITE_BYTE
+from control.ds2482 import COMMAND_1W_READ_BYTE, COMMAND_1W_TRIPLET
+from control.ds2482 import POINTER_STATUS, POINTER_DATA, POINTER_CONFIG
+from control.ds2482 import CONFIG_STRONG_PULLUP, CONFIG_1W_OVERDRIVE
+from control.ds2482 import STATUS_1W_BUSY, STATUS_PRESENCE_PULSE, STATUS_LOGIC_LEVEL
+from control.ds2482 import STATUS_DEVICE_RESET, STATUS_SINGLE_BIT, STATUS_TRIPLET_BIT
+from control.ds2482 import STATUS_BRANCH_TAKEN
+from control.ds2482 import COMMAND_ROM_OVERDRIVE_SKIP, COMMAND_ROM_OVERDRIVE_MATCH
+from control.ds2482 import ONEWIRE_TIMING
+from control.ds2482 import COMMAND_CHANNEL_SELECT, CHANNEL_SELECT, CHANNEL_READBACK
+from control.ds18b20 import DS18B20, DS18B20_SENSORS, FAMILY_CODE
+from control.ds18b20 import COMMAND_ROM_SEARCH, COMMAND_ROM_READ, COMMAND_ROM_MATCH
+from control.ds18b20 import COMMAND_ROM_SKIP, COMMAND_ROM_SEARCH_ALARM
+from control.ds18b20 import COMMAND_CONVERT_T, COMMAND_COPY_SCRATCH, COMMAND_WRITE_SCRATCH
+from control.ds18b20 import COMMAND_READ_SCRATCH, COMMAND_RECALL_EEPROM, COMMAND_READ_POWER
+from control.ds18b20 import CONVERT_TIME
+from control.mcp23008 import MCP23008_ADDRESS
+from control.mcp23008 import MCP23008_IODIR, MCP23008_IPOL, MCP23008_GPINTEN, MCP23008_DEFVAL
+from control.mcp23008 import MCP23008_INTCON, MCP23008_IOCON, MCP23008_INTF
+from control.mcp23008 import MCP23008_INTCAP, MCP23008_GPIO, MCP23008_OLAT, MCP23008_IOCON_SEQOP
+from control.bmp280 import BMP280, BMP280_I2C_ADDR
+from control.bmp280 import BMP280_CHIP_ID, BMP280_RESET, BMP280_STATUS, BMP280_CONTROL
+from control.bmp280 import BMP280_CONFIG, BMP280_DATA, BMP280_DIG_T1
+from control.bmp280 import BMP280_MODE_FORCED, BMP280_MODE_NORMAL, BMP280_MODE_MASK
+from control.bmp280 import BMP280_STATUS_BUSY, BMP280_STANDBY_MASK
+
+# BMP280 standby times (secs) by t_sb code
+BMP280_STANDBY_TIME = [0.0005, 0.0625, 0.125, 0.250, 0.500, 1.000, 2.000, 4.000]
+
+
+class SimI2C:
+    """Simulated busio.I2C bus, devices are attached by address"""
+
+    def __init__(self, clock=time, frequency=None):
+        self.clock = clock
+        self.devices = {}
+        self.transactions = 0
+
+        # Bus clock rate, when set each transaction takes simulated time on the clock
+        self.frequency = frequency
+        self._locked = False
+
+    def attach(self, device):
+        device.clock = self.clock
+        self.devices[device.address] = device
+        return device
+
+    def _device(self, address):
+        try:
+            return self.devices[address]
+        except KeyError:
+            raise OSError(121, 'Remote I/O error') from None
+
+    def _transfer(self, nbytes):
+        self.transactions += 1
+        if self.frequency:
+            # Start, address byte, data bytes with ack and stop
+            self.clock.sleep((nbytes + 1) * 9 / self.frequency)
+
+    def try_lock(self):
+        if self._locked:
+            return False
+        self._locked = True
+        return True
+
+    def unlock(self):
+        self._locked = False
+
+    def scan(self):
+        return sorted(self.devices)
+
+    def deinit(self):
+        pass
+
+    def writeto(self, address, buffer, *, start=0, end=None):
+        device = self._device(address)
+        data = bytes(buffer[start:end])
+        self._transfer(len(data))
+        if data:
+            device.write(data)
+
+    def readfrom_into(self, address, buffer, *, start=0, end=None):
+        device = self._device(address)
+        end = len(buffer) if end is None else end
+        self._transfer(end - start)
+        buffer[start:end] = device.read(end - start)
+
+    def writeto_then_readfrom(self, address, buffer_out, buffer_in, *,
+                              out_start=0, out_end=None, in_start=0, in_end=None):
+        self.writeto(address, buffer_out, start=out_start, end=out_end)
+        self.readfrom_into(address, buffer_in, start=in_start, end=in_end)
+
+
+#
+# 1-Wire devices
+#
+
+class SimOneWireDevice:
+    """1-Wire slave modelled at the time slot level
+
+    The protocol runs as a generator which yields the level the device drives for
+    each time slot (1 releases the bus) and is sent the resulting bus level.
+    Devices with overdrive follow the overdrive ROM commands, others only see
+    standard speed resets and time slots.
+    """
+
+    def __init__(self, rom, parasitic=True, overdrive_capable=False):
+        self.rom = bytes(rom)
+        self.parasitic = parasitic
+        self.overdrive_capable = overdrive_capable
+        self.overdrive = False
+        self.bus = None
+        self._proto = None
+        self._out = 1
+
+    @property
+    def clock(self):
+        return self.bus.clock
+
+    @property
+    def alarm(self):
+        return False
+
+    def reset(self, overdrive=False):
+        # Standard speed reset returns the device to standard speed, overdrive resets
+        # are only seen by devices already at overdrive speed
+        if overdrive and not self.overdrive:
+            return False
+        self.overdrive = overdrive
+        self._proto = self._protocol()
+        self._out = next(self._proto)
+        return True
+
+    def drive(self):
+        return self._out
+
+    def receive(self, level):
+        # Returns False once the device stops taking part in the transaction
+        if self._proto is None:
+            return False
+        try:
+            self._out = self._proto.send(level)
+            return True
+        except StopIteration:
+            self._proto = None
+            self._out = 1
+            return False
+
+    def pullup_released(self, t):
+        pass
+
+    def _recv_byte(self):
+        data = 0
+        for i in range(8):
+            data |= (yield 1) << i
+        return data
+
+    def _send_byte(self, data):
+        for i in range(8):
+            yield (data >> i) & 1
+
+    def _protocol(self):
+        cmd = yield from self._recv_byte()
+        if cmd == COMMAND_ROM_READ:
+            for b in self.rom:
+                yield from self._send_byte(b)
+            return
+        elif cmd == COMMAND_ROM_MATCH:
+            for b in self.rom:
+                if (yield from self._recv_byte()) != b:
+                    return
+        elif cmd == COMMAND_ROM_SKIP:
+            pass
+        elif cmd == COMMAND_ROM_OVERDRIVE_SKIP and self.overdrive_capable:
+            self.overdrive = True
+        elif cmd == COMMAND_ROM_OVERDRIVE_MATCH and self.overdrive_capable:
+            # ROM code follows at overdrive speed, devices not matching return to standard speed
+            self.overdrive = True
+            for b in self.rom:
+                if (yield from self._recv_byte()) != b:
+                    self.overdrive = False
+                    return
+        elif cmd == COMMAND_ROM_SEARCH or cmd == COMMAND_ROM_SEARCH_ALARM and self.alarm:
+            for i in range(64):
+                bit = (self.rom[i // 8] >> i % 8) & 1
+                yield bit
+                yield bit ^ 1
+                if (yield 1) != bit:
+                    return
+            return
+        else:
+            # Unsupported ROM commands, including overdrive skip and match without overdrive
+            return
+        yield from self._function()
+
+    def _function(self):
+        yield from self._recv_byte()
+
+
+class SimDS18B20(SimOneWireDevice):
+    """DS18B20 temperature sensor with scratchpad, EEPROM and conversion delay"""
+
+    def __init__(self, rom, temperature=20.0, parasitic=True, overdrive_capable=False):
+        super().__init__(rom, parasitic, overdrive_capable)
+
+        # Temperature (deg C) is a constant or a callable returning the current value
+        self.temperature = temperature
+
+        self.eeprom = bytearray([0x4B, 0x46, 0x7F])
+        self.scratch = bytearray([0x50, 0x05, 0, 0, 0, 0xFF, 0x0C, 0x10, 0])
+        self.scratch[2:5] = self.eeprom
+        self._update_crc()
+
+        self._ready = None
+        self._pending = None
+        self.conversions = 0
+        self.failed_conversions = 0
+
+    @classmethod
+    def from_serial(cls, serial, **kwargs):
+        rom = bytearray([FAMILY_CODE]) + serial.to_bytes(6, byteorder='little')
+        rom.append(DS18B20.calc_crc(rom))
+        return cls(rom, **kwargs)
+
+    def _update_crc(self):
+        self.scratch[8] = DS18B20.calc_crc(self.scratch[0:8])
+
+    def _measure(self):
+        t = self.temperature() if callable(self.temperature) else self.temperature
+        t = min(max(t, -55.0), 125.0)
+        mask = {0x1F: 0x07, 0x3F: 0x03, 0x5F: 0x01}.get(self.scratch[4], 0x00)
+        return int(round(t * 16)) & ~mask & 0xFFFF
+
+    @property
+    def converting(self):
+        self._complete()
+        return self._pending is not None
+
+    def _complete(self):
+        if self._pending is not None and self.clock.monotonic() >= self._ready:
+            self.scratch[0:2] = self._pending.to_bytes(2, byteorder='little')
+            self._update_crc()
+            self._pending = None
+
+    def _fail(self):
+        # Parasitic power lost during the conversion, registers revert to power on values
+        self.failed_conversions += 1
+        self._pending = 0x0550
+        self.scratch[2:5] = self.eeprom
+
+    @property
+    def alarm(self):
+        self._complete()
+        t = int.from_bytes(self.scratch[0:2], byteorder='little', signed=True) >> 4
+        th = int.from_bytes(self.scratch[2:3], byteorder='little', signed=True)
+        tl = int.from_bytes(self.scratch[3:4], byteorder='little', signed=True)
+        return t >= th or t <= tl
+
+    def pullup_released(self, t):
+        if self.parasitic and self._pending is not None and t < self._ready:
+            self._fail()
+
+    def _function(self):
+        self._complete()
+        cmd = yield from self._recv_byte()
+        if cmd == COMMAND_CONVERT_T:
+            self.conversions += 1
+            self._ready = self.clock.monotonic() + CONVERT_TIME.get(self.scratch[4], 0.750)
+            self._pending = self._measure()
+            if self.parasitic and not self.bus.strong_pullup:
+                self._fail()
+            while self.converting:
+                yield 0
+        elif cmd == COMMAND_READ_SCRATCH:
+            for b in self.scratch:
+                yield from self._send_byte(b)
+        elif cmd == COMMAND_WRITE_SCRATCH:
+            for i in range(2, 5):
+                self.scratch[i] = yield from self._recv_byte()
+            self.scratch[4] = self.scratch[4] & 0x60 | 0x1F
+            self._update_crc()
+        elif cmd == COMMAND_COPY_SCRATCH:
+            self.eeprom[:] = self.scratch[2:5]
+        elif cmd == COMMAND_RECALL_EEPROM:
+            self.scratch[2:5] = self.eeprom
+            self._update_crc()
+        elif cmd == COMMAND_READ_POWER:
+            yield 0 if self.parasitic else 1
+
+
+class SimOneWireBus:
+    """1-Wire segment, the bus level is the wired-AND of the master and all devices"""
+
+    def __init__(self, devices=(), clock=time):
+        self.clock = clock
+        self.devices = []
+        self.strong_pullup = False
+        self.overdrive = False
+
+        # Devices still taking part in the current transaction
+        self._active = []
+        for device in devices:
+            self.attach(device)
+
+    def attach(self, device):
+        device.bus = self
+        self.devices.append(device)
+        return device
+
+    def reset(self):
+        self._active = [device for device in self.devices if device.reset(self.overdrive)]
+        return bool(self._active)
+
+    def slot(self, bit=1):
+        # Devices at the other speed drop out of the transaction
+        if self.overdrive:
+            self._active = [device for device in self._active if device.overdrive]
+        level = bit
+        for device in self._active:
+            level &= device.drive()
+        self._active = [device for device in self._active if device.receive(level)]
+        return level
+
+    def release_pullup(self, t):
+        if self.strong_pullup:
+            self.strong_pullup = False
+            for device in self.devices:
+                device.pullup_released(t)
+
+
+#
+# I2C devices
+#
+
+class SimDS2482:
+    """DS2482-100 I2C to 1-Wire bridge with status register and busy timing
+
+    Given a list of channel buses it is a DS2482-800 with channel select.
+    """
+
+    # Read pointer after a channel select
+    POINTER_CHANNEL = 0xD2
+
+    def __init__(self, address=DS2482_ADDRESS, bus=None, channels=None):
+        self.address = address
+        self.channels = channels if channels is not None else [bus if bus is not None else SimOneWireBus()]
+        self.bus = self.channels[0]
+        self._device_reset()
+        self.commands = 0
+
+    # The 1-Wire devices share the bridge clock
+    @property
+    def clock(self):
+        return self.bus.clock
+
+    @clock.setter
+    def clock(self, clock):
+        for bus in self.channels:
+            bus.clock = clock
+
+    def _device_reset(self):
+        self.config = 0x00
+        self.status = STATUS_DEVICE_RESET | STATUS_LOGIC_LEVEL
+        self.pointer = POINTER_STATUS
+        self.data = 0xFF
+        self._busy_until = 0.0
+        self.bus = self.channels[0]
+
+    @property
+    def busy(self):
+        return self.clock.monotonic() < self._busy_until
+
+    def _onewire(self, slots=0, reset=False):
+        # Start a 1-Wire operation, any strong pullup ends with the next 1-Wire command
+        if self.busy:
+            raise OSError(121, 'Remote I/O error')
+        t = self.clock.monotonic()
+        self.bus.release_pullup(t)
+        self.bus.overdrive = bool(self.config & CONFIG_1W_OVERDRIVE)
+        timing = ONEWIRE_TIMING[self.bus.overdrive]
+        self._busy_until = t + slots * timing['slot'] + (timing['reset'] if reset else 0)
+        self.pointer = POINTER_STATUS
+        self.commands += 1
+
+    def _strong_pullup(self):
+        # Strong pullup follows the last time slot, set first so devices see it on that slot
+        if self.config & CONFIG_STRONG_PULLUP:
+            self.config &= ~CONFIG_STRONG_PULLUP
+            self.bus.strong_pullup = True
+
+    def write(self, data):
+        cmd = data[0]
+        if cmd == COMMAND_DEVICE_RESET:
+            self.bus.release_pullup(self.clock.monotonic())
+            self._device_reset()
+        elif cmd == COMMAND_SET_POINTER:
+            self.pointer = data[1]
+        elif cmd == COMMAND_WRITE_CONFIG:
+            if (data[1] >> 4) != (~data[1] & 0x0F):
+                raise OSError(121, 'Remote I/O error')
+            self.config = data[1] & 0x0F
+            self.status &= ~STATUS_DEVICE_RESET
+            self.pointer = POINTER_CONFIG
+        elif cmd == COMMAND_CHANNEL_SELECT and len(self.channels) > 1:
+            if self.busy or data[1] not in CHANNEL_SELECT:
+                raise OSError(121, 'Remote I/O error')
+            self.bus.release_pullup(self.clock.monotonic())
+            self.bus = self.channels[CHANNEL_SELECT.index(data[1])]
+            self.pointer = self.POINTER_CHANNEL
+        elif cmd == COMMAND_1W_RESET:
+            self._onewire(reset=True)
+            presence = self.bus.reset()
+            self.status &= ~(STATUS_PRESENCE_PULSE | STATUS_DEVICE_RESET)
+            self.status |= STATUS_PRESENCE_PULSE if presence else 0
+        elif cmd == COMMAND_1W_SINGLE_BIT:
+            self._onewire(slots=1)
+            self._strong_pullup()
+            level = self.bus.slot(1 if data[1] & 0x80 else 0)
+            self.status = self.status & ~STATUS_SINGLE_BIT | (STATUS_SINGLE_BIT if level else 0)
+        elif cmd == COMMAND_1W_WRITE_BYTE:
+            self._onewire(slots=8)
+            self._strong_pullup()
+            for i in range(8):
+                self.bus.slot((data[1] >> i) & 1)
+        elif cmd == COMMAND_1W_READ_BYTE:
+            self._onewire(slots=8)
+            self.data = 0
+            for i in range(8):
+                self.data |= self.bus.slot(1) << i
+        elif cmd == COMMAND_1W_TRIPLET:
+            self._onewire(slots=3)
+            id_bit = self.bus.slot(1)
+            cmp_bit = self.bus.slot(1)
+            if id_bit != cmp_bit:
+                dir = id_bit
+            else:
+                dir = 1 if data[1] & 0x80 else 0
+            self.bus.slot(dir)
+            self.status &= ~(STATUS_SINGLE_BIT | STATUS_TRIPLET_BIT | STATUS_BRANCH_TAKEN)
+            self.status |= (STATUS_SINGLE_BIT if id_bit else 0) | (STATUS_TRIPLET_BIT if cmp_bit else 0)
+            self.status |= STATUS_BRANCH_TAKEN if dir else 0
+        else:
+            raise OSError(121, 'Remote I/O error')
+
+    def read(self, n):
+        if self.pointer == POINTER_STATUS:
+            value = self.status | (STATUS_1W_BUSY if self.busy else 0)
+        elif self.pointer == POINTER_DATA:
+            value = self.data
+        elif self.pointer == POINTER_CONFIG:
+            value = self.config
+        elif self.pointer == self.POINTER_CHANNEL:
+            value = CHANNEL_READBACK[self.channels.index(self.bus)]
+        else:
+            value = 0xFF
+        return bytes([value] * n)
+
+
+class SimRegisterDevice:
+    """I2C device with an auto-incrementing register address pointer"""
+
+    def __init__(self, address, size=256):
+        self.address = address
+        self.clock = time
+        self.regs = bytearray(size)
+        self.pointer = 0
+
+    def _next(self):
+        self.pointer = (self.pointer + 1) % len(self.regs)
+
+    def read_reg(self, reg):
+        return self.regs[reg]
+
+    def write_reg(self, reg, value):
+        self.regs[reg] = value
+
+    def write(self, data):
+        self.pointer = data[0] % len(self.regs)
+        for value in data[1:]:
+            self.write_reg(self.pointer, value)
+            self._next()
+
+    def read(self, n):
+        buf = bytearray(n)
+        for i in range(n):
+            buf[i] = self.read_reg(self.pointer)
+            self._next()
+        return bytes(buf)
+
+
+class SimMCP23008(SimRegisterDevice):
+    """MCP23008 I/O expander, pins are the output latch or external input levels"""
+
+    def __init__(self, address=MCP23008_ADDRESS):
+        super().__init__(address, size=MCP23008_OLAT + 1)
+        self.reset()
+
+        # External levels on pins configured as inputs
+        self.inputs = 0xFF
+        self.writes = 0
+
+    def reset(self):
+        """Power-on reset, every pin an input and the other registers cleared"""
+        self.regs[:] = bytes(len(self.regs))
+        self.regs[MCP23008_IODIR] = 0xFF
+
+    def _next(self):
+        if not self.regs[MCP23008_IOCON] & MCP23008_IOCON_SEQOP:
+            super()._next()
+
+    @property
+    def pins(self):
+        iodir = self.regs[MCP23008_IODIR]
+        return (self.regs[MCP23008_OLAT] & ~iodir | self.inputs & iodir) & 0xFF
+
+    @property
+    def outputs(self):
+        """Output pin levels, pins configured as inputs read high"""
+        return (self.regs[MCP23008_OLAT] | self.regs[MCP23008_IODIR]) & 0xFF
+
+    def set_inputs(self, value):
+        """Change external input levels and latch any interrupt-on-change"""
+        before = self.pins
+        self.inputs = value & 0xFF
+        after = self.pins
+        gpinten = self.regs[MCP23008_GPINTEN] & self.regs[MCP23008_IODIR]
+        intcon = self.regs[MCP23008_INTCON]
+        changed = (before ^ after) & ~intcon | (after ^ self.regs[MCP23008_DEFVAL]) & intcon
+        if changed & gpinten and not self.regs[MCP23008_INTF]:
+            self.regs[MCP23008_INTF] = changed & gpinten
+            self.regs[MCP23008_INTCAP] = after ^ self.regs[MCP23008_IPOL]
+
+    @property
+    def interrupt(self):
+        return self.regs[MCP23008_INTF] != 0
+
+    def read_reg(self, reg):
+        if reg == MCP23008_GPIO:
+            self.regs[MCP23008_INTF] = 0
+            return (self.pins ^ self.regs[MCP23008_IPOL] & self.regs[MCP23008_IODIR]) & 0xFF
+        if reg == MCP23008_INTCAP:
+            self.regs[MCP23008_INTF] = 0
+        return self.regs[reg]
+
+    def write_reg(self, reg, value):
+        self.writes += 1
+        if reg == MCP23008_GPIO:
+            reg = MCP23008_OLAT
+        if reg in (MCP23008_INTF, MCP23008_INTCAP):
+            return
+        self.regs[reg] = value
+
+
+class SimBMP280(SimRegisterDevice):
+    """BMP280 with calibration registers, forced and normal mode conversions"""
+
+    def __init__(self, address=BMP280_I2C_ADDR, temperature=20.0, pressure=101325.0):
+        super().__init__(address)
+
+        # Temperature (deg C) and pressure (Pa), constants or callables
+        self.temperature = temperature
+        self.pressure = pressure
+
+        # Datasheet sample calibration
+        self._comp = BMP280.__new__(BMP280)
+        self._comp.load_calibration(sample=True)
+        calib = [
+            self._comp.dig_t1, self._comp.dig_t2, self._comp.dig_t3,
+            self._comp.dig_p1, self._comp.dig_p2, self._comp.dig_p3,
+            self._comp.dig_p4, self._comp.dig_p5, self._comp.dig_p6,
+            self._comp.dig_p7, self._comp.dig_p8, self._comp.dig_p9,
+        ]
+        for i, value in enumerate(calib):
+            reg = BMP280_DIG_T1 + 2 * i
+            self.regs[reg:reg + 2] = (value & 0xFFFF).to_bytes(2, byteorder='little')
+
+        self._power_on_reset()
+
+    def _power_on_reset(self):
+        self.regs[BMP280_CHIP_ID] = 0x58
+        self.regs[BMP280_CONTROL] = 0x00
+        self.regs[BMP280_CONFIG] = 0x00
+        self.regs[BMP280_DATA:BMP280_DATA + 6] = bytes([0x80, 0x00, 0x00, 0x80, 0x00, 0x00])
+        self._busy_until = 0.0
+        self._next_sample = None
+
+    @property
+    def conversion_time(self):
+        # Datasheet typical measurement time for the oversampling settings
+        ctrl = self.regs[BMP280_CONTROL]
+        osrs_t = (1 << ((ctrl >> 5) & 0x07) - 1) if ctrl & 0xE0 else 0
+        osrs_p = (1 << ((ctrl >> 2) & 0x07) - 1) if ctrl & 0x1C else 0
+        return 0.001 + 0.002 * min(osrs_t, 16) + (0.002 * min(osrs_p, 16) + 0.0005 if osrs_p else 0)
+
+    def _raw(self, temperature, pressure):
+        # Invert the compensation formulas by bisection, both are monotonic in the raw value
+        def solve(f, target, increasing):
+            lo, hi = 0, (1 << 20) - 1
+            while lo < hi:
+                mid = (lo + hi) // 2
+                if (f(mid) < target) == increasing:
+                    lo = mid + 1
+                else:
+                    hi = mid
+            return lo
+        adc_t = solve(lambda adc: self._comp.compensate(415148, adc)[1], temperature, True)
+        adc_p = solve(lambda adc: self._comp.compensate(adc, adc_t)[0], pressure, False)
+        return adc_p, adc_t
+
+    def _sample(self):
+        t = self.temperature() if callable(self.temperature) else self.temperature
+        p = self.pressure() if callable(self.pressure) else self.pressure
+        adc_p, adc_t = self._raw(t, p)
+        self.regs[BMP280_DATA:BMP280_DATA + 6] = bytes([
+            adc_p >> 12 & 0xFF, adc_p >> 4 & 0xFF, adc_p << 4 & 0xF0,
+            adc_t >> 12 & 0xFF, adc_t >> 4 & 0xFF, adc_t << 4 & 0xF0,
+        ])
+
+    def _update(self):
+        now = self.clock.monotonic()
+        mode = self.regs[BMP280_CONTROL] & BMP280_MODE_MASK
+        if self._next_sample is not None and now >= self._next_sample:
+            self._sample()
+            if mode == BMP280_MODE_NORMAL:
+                standby = BMP280_STANDBY_TIME[(self.regs[BMP280_CONFIG] & BMP280_STANDBY_MASK) >> 5]
+                period = self.conversion_time + standby
+                self._next_sample += period * ((now - self._next_sample) // period + 1)
+                self._busy_until = self._next_sample - standby
+            else:
+                # Forced conversion complete, back to sleep mode
+                self.regs[BMP280_CONTROL] &= ~BMP280_MODE_MASK
+                self._next_sample = None
+
+    def read_reg(self, reg):
+        self._update()
+        if reg == BMP280_STATUS:
+            return BMP280_STATUS_BUSY if self.clock.monotonic() < self._busy_until else 0
+        return self.regs[reg]
+
+    def write_reg(self, reg, value):
+        self._update()
+        if reg == BMP280_RESET:
+            if value == 0xB6:
+                self._power_on_reset()
+        elif reg == BMP280_CONTROL:
+            self.regs[reg] = value
+            mode = value & BMP280_MODE_MASK
+            if mode in (BMP280_MODE_FORCED, BMP280_MODE_NORMAL):
+                self._busy_until = self.clock.monotonic() + self.conversion_time
+                self._next_sample = self._busy_until
+            else:
+                self._next_sample = None
+        elif reg == BMP280_CONFIG:
+            self.regs[reg] = value
+
+
+#
+# Seedling hardware
+#
+
+def seedling_bus(clock=time, temperature=20.0, parasitic=True, frequency=None):
+    """Simulated I2C bus with the seedling controller hardware attached
+
+    Every sensor in DS18B20_SENSORS is on the 1-Wire bus. Returns the bus and
+    a dict of the simulated devices by name, sensors use their sensor IDs.
+    """
+    i2c = SimI2C(clock, frequency=frequency)
+    onewire = SimOneWireBus()
+    devices = {
+        'ds2482': i2c.attach(SimDS2482(bus=onewire)),
+        'mcp23008': i2c.attach(SimMCP23008()),
+        'bmp280': i2c.attach(SimBMP280()),
+    }
+    for temp_id, rom in DS18B20_SENSORS.items():
+        devices[temp_id] = onewire.attach(SimDS18B20(rom, temperature=temperature, parasitic=parasitic))
+    return i2c, devices
+
+
+if __name__ == '__main__':
+
+    import queue
+    import threading
+    import control.control as control
+
+    i2c, devices = seedling_bus()
+    for i, temp_id in enumerate(('C1', 'C2', 'C3', 'C4', 'C5')):
+        devices[temp_id].temperature = 22.0 + i
+
+    msg_queue = queue.Queue()
+    rsp_queue = queue.Queue()
+    ctl = control.Control(msg_queue, rsp_queue, i2c=i2c, startup_file=None)
+    ctl_thread = threading.Thread(target=ctl.main_loop_async if control.ASYNC_ENGINE else ctl.main_loop)
+    ctl_thread.start()
+
+    time.sleep(control.CYCLE_TIME + 1)
+    msg_queue.put('set a on')
+    print(rsp_queue.get())
+    msg_queue.put('stat')
+    print(rsp_queue.get())
+    msg_queue.put('end')
+    ctl_thread.join()
+
+    print('i2c transactions: %d, relays: %02x' % (i2c.transactions, devices['mcp23008'].outputs))
@@ -0,0 +1,113 @@
+import math
+import time
+import struct
+import multiprocessing
+from multiprocessing import shared_memory
+
+from control import seqlock
+
+# Block header: sequence counter, number of channels, time of last update
+HEADER = struct.Struct('<IId')
+
+# Channel record: name, flags, temperature (NaN if unknown), setpoint, pressure (hPa, NaN if unknown)
+CHANNEL = struct.Struct('<8sBdid')
+
+FLAG_CONTROL        = 0x01
+FLAG_ENABLED        = 0x02
+FLAG_RELAY          = 0x04
+FLAG_RELAY_KNOWN    = 0x08
+FLAG_SET_KNOWN      = 0x10
+FLAG_PRESSURE       = 0x20
+
+
+class StatusBlock:
+    """Channel status snapshot in shared memory
+
+    The control process publishes after every cycle and command, readers copy the
+    block without locking. The sequence counter is odd while an update is in
+    progress, a reader retries if it changes while copying. The changed event is
+    set on every publish for readers waiting on updates.
+    """
+
+    def __init__(self, nchans):
+        self.nchans = nchans
+        self.size = HEADER.size + nchans * CHANNEL.size
+        self.shm = shared_memory.SharedMemory(create=True, size=self.size)
+        HEADER.pack_into(self.shm.buf, 0, 0, nchans, 0.0)
+        self.changed = multiprocessing.Event()
+
+    def publish(self, ctl_chans, aux_chans):
+        buf = self.shm.buf
+        seq = HEADER.unpack_from(buf, 0)[0]
+        struct.pack_into('<I', buf, 0, (seq + 1) & 0xFFFFFFFF)
+        offset = HEADER.size
+        for chan in list(ctl_chans) + list(aux_chans):
+            flags = 0
+            if chan.port is not None:
+                flags |= FLAG_CONTROL
+                flags |= FLAG_ENABLED if chan.enabled else 0
+                flags |= FLAG_RELAY if chan.relay else 0
+                flags |= FLAG_RELAY_KNOWN if chan.relay is not None else 0
+                flags |= FLAG_SET_KNOWN if chan.set is not None else 0
+            if hasattr(chan, 'pressure'):
+                flags |= FLAG_PRESSURE
+            temp = chan.temp if chan.temp is not None else math.nan
+            pressure = chan.pressure if getattr(chan, 'pressure', None) is not None else math.nan
+            CHANNEL.pack_into(buf, offset, chan.name.encode(), flags, temp, chan.set or 0, pressure)
+            offset += CHANNEL.size
+        HEADER.pack_into(buf, 0, (seq + 2) & 0xFFFFFFFF, self.nchans, time.time())
+        self.changed.set()
+
+    def snapshot(self):
+        """Consistent copy of the block, the header sequence is even"""
+        return seqlock.read(self._copy)
+
+    def _copy(self):
+        buf = self.shm.buf
+        seq = HEADER.unpack_from(buf, 0)[0]
+        if not seq & 1:
+            data = bytes(buf[:self.size])
+            if HEADER.unpack_from(buf, 0)[0] == seq:
+                return data
+        return None
+
+    def read(self):
+        """Channel status in the same form as the STAT command response"""
+        data = self.snapshot()
+        seq, nchans, updated = HEADER.unpack_from(data, 0)
+        ctl_chans = []
+        aux_chans = []
+        for i in range(nchans):
+            name, flags, temp, setpoint, pressure = CHANNEL.unpack_from(data, HEADER.size + i * CHANNEL.size)
+            name = name.rstrip(b'\0').decode()
+            temp = None if math.isnan(temp) else temp
+            if flags & FLAG_CONTROL:
+                ctl_chans.append({
+                    'name': name,
+                    'temp': temp,
+                    'enabled': bool(flags & FLAG_ENABLED),
+                    'set': setpoint if flags & FLAG_SET_KNOWN else None,
+                    'relay': bool(flags & FLAG_RELAY) if flags & FLAG_RELAY_KNOWN else None
+                })
+            elif flags & FLAG_PRESSURE:
+                aux_chans.append({
+                    'name': name,
+                    'temp': temp,
+                    'pressure': None if math.isnan(pressure) else pressure
+                })
+            else:
+                aux_chans.append({
+                    'name': name,
+                    'temp': temp
+                })
+        return {'error': None, 'ctl_chans': ctl_chans, 'aux_chans': aux_chans, 'seq': seq, 'updated': updated}
+
+    def close(self):
+        self.shm.close()
+
+    # Control.close unlinks the block, a second unlink from the parent is a no-op
+    def unlink(self):
+        try:
+            self.shm.unlink()
+        except FileNotFoundError:
+            pass
@@ -2,10 +2,13 @@ import time
 import queue
 import os, signal
 from web import app
+from web.commands import CommandClient
+from web.events import EventBroadcaster
 from waitress import serve
 
 from multiprocessing import Process, Queue
-from control.control import Control, shutdown
+from control.control import Control, shutdown, ASYNC_ENGINE
+from control.history import History
 
 PID_FILE = os.path.join(os.path.dirname(__file__), 'seedling.pid')
 
@@ -27,14 +30,21 @@ if __name__ == '__main__':
     rsp_queue = Queue()
     app.config['msg_queue'] = msg_queue
     app.config['rsp_queue'] = rsp_queue
-    control = Control(msg_queue, rsp_queue)
-
-    control_proc = Process(target=control.main_loop, daemon=False)
+    app.config['commands'] = CommandClient(msg_queue, rsp_queue)
+    control = Control(msg_queue, rsp_queue, history=History(app.config['DATABASE']),
+                      ring_file=os.path.join(os.path.dirname(app.config['DATABASE']), 'samples.ring'))
+    app.config['metrics'] = control.metrics
+    app.config['status'] = control.status
+    app.config['ring'] = control.ring
+    app.config['events'] = EventBroadcaster(control.status)
+
+    control_proc = Process(target=control.main_loop_async if ASYNC_ENGINE else control.main_loop, daemon=False)
     control_proc.start()
     # print('seedling: control process started, daemon: %s' % control_proc.daemon)
 
     # serve(app, listen='0.0.0.0:8080')
-    web_proc = Process(target=serve, args=(app,), kwargs={'listen': '0.0.0.0:8080'}, daemon=False)
+    # Each open event stream holds a server thread, up to web.events.MAX_STREAMS of them
+    web_proc = Process(target=serve, args=(app,), kwargs={'listen': '0.0.0.0:8080', 'threads': 16}, daemon=False)
     web_proc.start()
     # print('seedling: web process started, daemon: %s' % web_proc.daemon)
 
@@ -76,6 +86,11 @@ if __name__ == '__main__':
     print('seedling: join control')
     control_proc.join()
 
+    # The control process unlinks the status block on a clean exit, unlink again in case it died
+    control.status.close()
+    control.status.unlink()
+    control.ring.close()
+
     print('seedling: shutdown input/output')
     shutdown()
 
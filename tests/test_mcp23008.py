@@ -0,0 +1,53 @@
+import unittest
+
+from control.control import RELAY_MASK
+from control.mcp23008 import MCP23008, MCP23008_IODIR, MCP23008_OLAT
+from control.simulator import SimI2C, SimMCP23008
+
+
+class RecordingMCP23008(SimMCP23008):
+    """SimMCP23008 that records the output pin levels after every register write"""
+
+    def __init__(self):
+        super().__init__()
+        self.history = []
+
+    def write_reg(self, reg, value):
+        super().write_reg(reg, value)
+        self.history.append(self.outputs)
+
+
+class TestResyncRestore(unittest.TestCase):
+
+    def setUp(self):
+        self.i2c = SimI2C()
+        self.sim = self.i2c.attach(RecordingMCP23008())
+        self.gpio = MCP23008(self.i2c)
+
+    def restore_after_reset(self):
+        self.sim.reset()
+        self.sim.history.clear()
+        return self.gpio.resync(restore=True)
+
+    def test_relays_stay_off(self):
+        # Relays are active low, configured the way Control does at init
+        self.gpio.output_high(RELAY_MASK).config_output(RELAY_MASK)
+        changed = self.restore_after_reset()
+        self.assertEqual(changed, [MCP23008_OLAT, MCP23008_IODIR])
+        self.assertTrue(self.sim.history)
+        for outputs in self.sim.history:
+            self.assertEqual(outputs & RELAY_MASK, RELAY_MASK)
+        self.assertEqual(self.sim.regs[MCP23008_IODIR], 0xFF & ~RELAY_MASK)
+
+    def test_relay_on_restored(self):
+        self.gpio.output_high(RELAY_MASK).config_output(RELAY_MASK)
+        self.gpio.output_low(RELAY_MASK & 0x01)
+        self.restore_after_reset()
+        # Only the relay that was on goes low, and only once IODIR is written
+        for outputs in self.sim.history[:-1]:
+            self.assertEqual(outputs & RELAY_MASK, RELAY_MASK)
+        self.assertEqual(self.sim.history[-1] & RELAY_MASK, RELAY_MASK & ~0x01)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,4 +1,4 @@
-from flask import Flask
+from flask import Flask, g
 
 app = Flask(__name__)
 
@@ -29,4 +29,6 @@ def teardown_request(exception):
 
 @app.teardown_appcontext
 def teardown_appcontext(exception):
-    pass
+    db = g.pop('db', None)
+    if db is not None:
+        db.close()
@@ -0,0 +1,28 @@
+import os
+import threading
+
+
+class BackgroundThread:
+    """A daemon thread started on first use in the process serving requests
+
+    The objects owning these threads are created before the web server forks, a
+    thread started then would not run in the child. start() starts the thread once
+    per process, after reset() clears any state copied from the parent.
+    """
+
+    def __init__(self, target, name, reset=None):
+        self._target = target
+        self._name = name
+        self._reset = reset
+        self._lock = threading.Lock()
+        self._pid = None
+
+    def start(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                if self._reset is not None:
+                    self._reset()
+                threading.Thread(target=self._target, name=self._name, daemon=True).start()
@@ -0,0 +1,52 @@
+import time
+import itertools
+import threading
+from concurrent.futures import Future, TimeoutError
+
+from web.background import BackgroundThread
+
+# Seconds to wait for the controller to respond
+RESPONSE_TIMEOUT = 5.0
+
+
+class CommandClient:
+    """Sends command messages to the controller and routes each response to its caller
+
+    Messages carry a request ID which the controller returns with the response. A
+    dispatcher thread in the web process reads the response queue and completes the
+    future for the waiting request thread, so any number of commands can be in flight.
+    """
+
+    def __init__(self, msg_queue, rsp_queue):
+        self.msg_queue = msg_queue
+        self.rsp_queue = rsp_queue
+        self._ids = itertools.count(1)
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._dispatcher = BackgroundThread(self._dispatch, 'seedling-dispatch', reset=self._pending.clear)
+
+    def _dispatch(self):
+        while True:
+            rsp = self.rsp_queue.get()
+            if not isinstance(rsp, tuple):
+                # Response to a message without a request ID
+                continue
+            req_id, rsp = rsp
+            with self._lock:
+                future = self._pending.pop(req_id, None)
+            if future is not None:
+                future.set_result(rsp)
+
+    def send(self, msg, timeout=RESPONSE_TIMEOUT):
+        self._dispatcher.start()
+        future = Future()
+        with self._lock:
+            req_id = next(self._ids)
+            self._pending[req_id] = future
+        self.msg_queue.put((req_id, time.monotonic(), msg))
+        try:
+            return future.result(timeout)
+        except TimeoutError:
+            with self._lock:
+                self._pending.pop(req_id, None)
+            return {'error': 'No response from controller.'}
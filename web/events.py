@@ -0,0 +1,109 @@
+import json
+import queue
+import threading
+
+from web.background import BackgroundThread
+
+# Seconds between keep-alive comments on idle streams, a client that went away is
+# only noticed on the next write and holds its server thread until then
+KEEPALIVE = 5.0
+
+# Most open streams, each holds a web server thread. Half of the 16 threads seedling.py
+# gives the server, further clients are refused and poll /stat instead.
+MAX_STREAMS = 8
+
+# Events buffered for a slow client before it is sent a full snapshot instead
+CLIENT_QUEUE_SIZE = 16
+
+
+class EventBroadcaster:
+    """Fans channel status changes out to Server-Sent Events clients
+
+    A single thread in the web process waits for the controller to publish a new
+    status snapshot, works out which channels changed and queues the delta for
+    every connected client.
+    """
+
+    def __init__(self, status):
+        self.status = status
+        self._clients = set()
+        self._lock = threading.Lock()
+        self._last = {}
+        self._broadcaster = BackgroundThread(self._broadcast, 'seedling-events', reset=self._reset)
+
+    def _reset(self):
+        with self._lock:
+            self._clients.clear()
+            self._last = self._chans(self.status.read())
+
+    @staticmethod
+    def _chans(stat):
+        return {chan['name']: chan for chan in stat['ctl_chans'] + stat['aux_chans']}
+
+    def _broadcast(self):
+        while True:
+            self.status.changed.wait()
+            self.status.changed.clear()
+            stat = self.status.read()
+            chans = self._chans(stat)
+            delta = {
+                'seq': stat['seq'],
+                'ctl_chans': [c for c in stat['ctl_chans'] if self._last.get(c['name']) != c],
+                'aux_chans': [c for c in stat['aux_chans'] if self._last.get(c['name']) != c],
+            }
+            self._last = chans
+            if not delta['ctl_chans'] and not delta['aux_chans']:
+                continue
+            event = 'event: delta\ndata: %s\n\n' % json.dumps(delta)
+            with self._lock:
+                clients = list(self._clients)
+            for client in clients:
+                try:
+                    client.put_nowait(event)
+                except queue.Full:
+                    # Client fell behind, drop its backlog and resynchronize with a snapshot
+                    while not client.empty():
+                        client.get_nowait()
+                    client.put_nowait(None)
+
+    def _snapshot(self):
+        return 'event: stat\ndata: %s\n\n' % json.dumps(self.status.read())
+
+    def stream(self):
+        """Event stream for one client, None if MAX_STREAMS are already open"""
+        self._broadcaster.start()
+        client = queue.Queue(CLIENT_QUEUE_SIZE)
+        with self._lock:
+            if len(self._clients) >= MAX_STREAMS:
+                return None
+            self._clients.add(client)
+        return EventStream(self, client)
+
+    def _disconnect(self, client):
+        with self._lock:
+            self._clients.discard(client)
+
+
+class EventStream:
+    """One client's events, a full snapshot followed by deltas
+
+    The WSGI server calls close() when the response ends or the client goes away,
+    which gives up the client's stream slot even if it was never iterated.
+    """
+
+    def __init__(self, broadcaster, client):
+        self._broadcaster = broadcaster
+        self._client = client
+
+    def __iter__(self):
+        yield self._broadcaster._snapshot()
+        while True:
+            try:
+                event = self._client.get(timeout=KEEPALIVE)
+            except queue.Empty:
+                yield ': keep-alive\n\n'
+                continue
+            yield self._broadcaster._snapshot() if event is None else event
+
+    def close(self):
+        self._broadcaster._disconnect(self._client)
@@ -1,32 +1,87 @@
-import queue
+import time
+import sqlite3
 
-from flask import request
+from flask import request, Response, g
 from flask import render_template, flash
 from flask.json import jsonify, dumps
 
 from web import app
+from control import history
+
+# History database connection for this request, read only, the control process writes
+def history_db():
+    if 'db' not in g:
+        g.db = sqlite3.connect('file:%s?mode=ro' % app.config['DATABASE'], uri=True)
+    return g.db
 
 @app.route('/stat', methods=['GET'])
 def stat():
 
-    app.config['msg_queue'].put('stat')
+    # Read the snapshot the controller publishes to shared memory
+    return jsonify(app.config['status'].read())
+
+@app.route('/events', methods=['GET'])
+def events():
+
+    # Server-Sent Events stream of channel status changes, refused once every stream slot
+    # is taken so the other requests keep some server threads
+    stream = app.config['events'].stream()
+    if stream is None:
+        rsp = jsonify({'error': 'Too many event streams.'})
+        rsp.status_code = 503
+        return rsp
+    rsp = Response(stream, mimetype='text/event-stream')
+    rsp.headers['Cache-Control'] = 'no-cache'
+    return rsp
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+
+    # Read directly from shared memory, the control loop is not involved
+    return Response(app.config['metrics'].render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/history', methods=['GET'])
+def history_series():
+
+    # Series for a time range (secs since the epoch), e.g. /history?start=1700000000&res=hour
+    # Resolution is raw, hour or day, picked from the range length if not given or
+    # if raw is asked for a range longer than history.RAW_SPAN_MAX
+    end = request.args.get('end', time.time(), type=float)
+    start = request.args.get('start', end - history.DAY, type=float)
+    res = request.args.get('res')
+    if res not in (None, 'raw') and res not in history.RESOLUTIONS:
+        return jsonify({'error': 'Bad resolution: %s' % res})
     try:
-        rsp = app.config['rsp_queue'].get(timeout=5.0)
-    except queue.Empty:
-        rsp = {'error': 'No response from controller.'}
+        rsp = history.query(history_db(), int(start), int(end), res)
+    except sqlite3.Error as e:
+        return jsonify({'error': 'History not available: %s' % e})
+    rsp['error'] = None
+    return jsonify(rsp)
+
+@app.route('/recent', methods=['GET'])
+def recent():
 
+    # Samples from the in-memory ring, e.g. /recent?hours=24
+    hours = request.args.get('hours', 24, type=float)
+    rsp = app.config['ring'].samples(int(time.time() - hours * 3600))
+    rsp['error'] = None
     return jsonify(rsp)
 
+@app.route('/set', methods=['GET', 'POST'])
+def set_chans():
+
+    # Several channel changes in one command, e.g. /set?A=%2B3&B=ON
+    params = ' '.join('%s %s' % (name, val) for name, val in request.values.items())
+    if not params:
+        return jsonify({'error': 'No channel changes.'})
+    return jsonify(app.config['commands'].send('SET ' + params))
+
 @app.route('/', methods=['GET'])
 def seedling():
 
     msg = request.args.get('msg')
     if msg:
-        app.config['msg_queue'].put(msg)
-        try:
-            rsp = app.config['rsp_queue'].get(timeout=5.0)
-        except queue.Empty:
-            rsp = {'error': 'No response from controller.'}
+        rsp = app.config['commands'].send(msg)
 
         if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
             return jsonify(rsp)